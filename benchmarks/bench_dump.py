@@ -0,0 +1,64 @@
+"""Rows per second of per-device commits versus the bulk dump path
+
+Run from the repository root: python -m benchmarks.bench_dump [DEVICE_COUNT]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-bench-")
+
+from deviceinfocompare.data import Device, Dump
+from deviceinfocompare.processors import BaseProcessor
+
+
+def make_devices(count: int):
+    return [
+        Device(
+            device_id=f"PCI\\VEN_{i:04X}&DEV_{i * 7 % 65536:04X}\\{i}",
+            device_name=f"Synthetic device {i}",
+            device_class=("System", "USB", "Display", "Net")[i % 4],
+            device_status=i % 10 != 0,
+        )
+        for i in range(count)
+    ]
+
+
+def dump_per_device(processor: BaseProcessor, devices) -> None:
+    """The old WindowsProcessor.dump_devices behavior: one commit per device"""
+
+    dump = Dump(datetime=None, desc="Per-device commit")
+    processor.session.add(dump)
+    processor.session.commit()
+    processor.session.refresh(dump)
+
+    for device in devices:
+        device.dump_id = dump.id
+        processor.session.add(device)
+        processor.session.commit()
+
+
+def measure(name: str, fn, count: int) -> None:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<20} {count:>8} rows {elapsed:>9.3f} s {count / elapsed:>12.0f} rows/s"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    processor = BaseProcessor()
+
+    devices = make_devices(count)
+    measure("per-device commit", lambda: dump_per_device(processor, devices), count)
+
+    devices = make_devices(count)
+    measure("bulk save_dump", lambda: processor.save_dump("Bulk", devices), count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Startup time of short commands against a budget over the bare interpreter
+
+Run from the repository root: python -m benchmarks.bench_importtime [BUDGET_MS]
+
+Exits with 1 when a command is over the budget or touches the database. The
+commands run from an empty directory like an installed cdic, the .env of the
+repository is for development and loads python-dotenv
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 7
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = (
+    ("cdic --version", [os.path.join(REPO_DIR, "cdic.py"), "--version"]),
+    ("cdic --help", [os.path.join(REPO_DIR, "cdic.py"), "--help"]),
+    ("import settings", ["-c", "import deviceinfocompare.settings"]),
+)
+
+
+def run_command(args, env, cwd) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *args],
+        env=env,
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def median_time(args, env, cwd) -> float:
+    return statistics.median(run_command(args, env, cwd) for _ in range(RUNS))
+
+
+def slowest_imports(args, env, cwd, count: int = 5):
+    """The top level imports of a command by cumulative microseconds"""
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        env=env,
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    ).stderr
+
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):  # Nested imports are indented
+            imports.append((int(cumulative), name.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    work_dir = tempfile.mkdtemp(prefix="dic-bench-")
+    base_dir = os.path.join(work_dir, "base")
+    env = {**os.environ, "DIC_BASE_DIR": base_dir, "PYTHONPATH": REPO_DIR}
+
+    bare_ms = median_time(["-c", "pass"], env, work_dir)
+    print(f"{'bare interpreter':<16} {bare_ms:>8.1f} ms")
+
+    failed = False
+    for name, args in COMMANDS:
+        overhead_ms = median_time(args, env, work_dir) - bare_ms
+        imports = ", ".join(
+            f"{module} {cumulative / 1000:.1f}"
+            for cumulative, module in slowest_imports(args, env, work_dir)
+        )
+        status = "ok" if overhead_ms <= budget_ms else "OVER BUDGET"
+        print(f"{name:<16} {overhead_ms:>+8.1f} ms  {status:<11}  {imports}")
+        failed = failed or overhead_ms > budget_ms
+
+    if os.path.exists(base_dir):
+        print("The database or the logs were set up by a short command")
+        failed = True
+
+    print(f"Budget is {budget_ms:.0f} ms over the bare interpreter")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
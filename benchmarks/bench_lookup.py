@@ -0,0 +1,82 @@
+"""Dump lookup latency with and without the schema indexes
+
+Run from the repository root: python -m benchmarks.bench_lookup [DUMPS] [DEVICES]
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-bench-")
+
+from sqlalchemy import insert, text
+
+from deviceinfocompare.data import Device, Dump
+from deviceinfocompare.migrations import MIGRATIONS
+from deviceinfocompare.processors import BaseProcessor
+
+INDEX_NAMES = ("ix_device_dump_id", "ix_device_device_id")
+
+
+def fill_db(processor: BaseProcessor, dump_count: int, device_count: int) -> None:
+    for dump_id in range(1, dump_count + 1):
+        processor.session.execute(insert(Dump).values(id=dump_id, desc="Synthetic"))
+        processor.session.execute(
+            insert(Device),
+            [
+                {
+                    "device_id": f"USB\\VID_{i:04X}\\{i}",
+                    "device_name": f"Synthetic device {i}",
+                    "device_class": "USB",
+                    "device_status": (i + dump_id) % 50 != 0,
+                    "dump_id": dump_id,
+                }
+                for i in range(device_count)
+            ],
+        )
+    processor.session.commit()
+
+
+def measure(name: str, processor: BaseProcessor, dump_count: int) -> None:
+    rnd = random.Random(42)
+    timings = []
+
+    for _ in range(50):
+        dump_id = rnd.randint(1, dump_count)
+        start = time.perf_counter()
+        list(processor.get_devices_by_dump_id(dump_id))
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    print(
+        f"{name:<12} median {statistics.median(timings):>9.2f} ms"
+        f"   p95 {timings[int(len(timings) * 0.95)]:>9.2f} ms"
+    )
+
+
+def main():
+    dump_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    device_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    processor = BaseProcessor()
+    fill_db(processor, dump_count, device_count)
+    print(f"{dump_count} dumps with {device_count} devices each")
+
+    measure("indexed", processor, dump_count)
+
+    for index_name in INDEX_NAMES:
+        processor.session.execute(text(f"DROP INDEX {index_name}"))
+    processor.session.commit()
+
+    measure("no indexes", processor, dump_count)
+
+    with processor.engine.begin() as conn:
+        for pending in MIGRATIONS:
+            pending.apply(conn)
+
+
+if __name__ == "__main__":
+    main()
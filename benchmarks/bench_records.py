@@ -0,0 +1,72 @@
+"""Memory per device and stored dump compare time, ORM objects versus DeviceRecord
+
+Run from the repository root: python -m benchmarks.bench_records [DEVICE_COUNT]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-bench-")
+
+from deviceinfocompare.compare import diff_device_lists
+from deviceinfocompare.data import Device, DeviceRecord
+from deviceinfocompare.processors import BaseProcessor
+
+
+def make_records(count: int, salt: int = 0):
+    return [
+        DeviceRecord(
+            f"PCI\\VEN_{i:04X}\\{i}",
+            f"Synthetic device {i}",
+            ("System", "USB", "Display", "Net")[i % 4],
+            (i + salt) % 97 != 0,
+        )
+        for i in range(count)
+    ]
+
+
+def measure_memory(name: str, factory, count: int) -> None:
+    tracemalloc.start()
+    devices = factory()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del devices
+    print(f"{name:<14} {size / count:>8.0f} bytes per device")
+
+
+def measure_compare(name: str, load, old_id: int, new_id: int) -> None:
+    start = time.perf_counter()
+    diff_device_lists(load(new_id), load(old_id))
+    print(f"{name:<14} {time.perf_counter() - start:>8.3f} s to load and compare")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    measure_memory(
+        "ORM Device",
+        lambda: [
+            Device(**record._asdict(), dump_id=1) for record in make_records(count)
+        ],
+        count,
+    )
+    measure_memory("DeviceRecord", lambda: make_records(count), count)
+
+    processor = BaseProcessor()
+    old_id = processor.save_dump("Old", make_records(count)).id
+    new_id = processor.save_dump("New", make_records(count, salt=1)).id
+
+    measure_compare(
+        "ORM Device",
+        lambda dump_id: processor.session.query(Device).filter_by(dump_id=dump_id),
+        old_id,
+        new_id,
+    )
+    measure_compare("DeviceRecord", processor.get_devices_by_dump_id, old_id, new_id)
+
+
+if __name__ == "__main__":
+    main()
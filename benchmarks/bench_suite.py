@@ -0,0 +1,225 @@
+"""Timings of the main processor operations on synthetic devices
+
+Run from the repository root: python -m benchmarks.bench_suite [--sizes 100,1000]
+    [--baseline OLD.json] [--threshold 0.25]
+
+Every size runs in a fresh process against its own temporary database. The
+results are written as JSON, with --baseline the run fails when an operation
+got slower than the threshold allows
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+OPERATIONS = (
+    "enumerate",
+    "dump_devices",
+    "compare_device_list",
+    "get_devices_by_dump_id",
+    "get_dump_list",
+    "remove_dump",
+    "clear_dumps",
+)
+
+# Differences below this many seconds are noise, not regressions
+NOISE_FLOOR = 0.005
+
+
+def time_call(fn: Callable) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def median_time(fn: Callable, repeat: int) -> float:
+    return statistics.median(time_call(fn) for _ in range(repeat))
+
+
+def run_size(
+    size: int,
+    dump_count: int,
+    churn: float,
+    flip_rate: float,
+    repeat: int,
+    storage_mode: str,
+) -> Dict[str, float]:
+    """Time the operations on size devices, runs in a process of its own"""
+
+    base_dir = tempfile.mkdtemp(prefix="dic-bench-")
+    os.environ["DIC_BASE_DIR"] = base_dir
+    os.environ["DIC_STORAGE_MODE"] = storage_mode
+    os.environ["DIC_SNAPSHOT_TTL"] = "0"
+
+    from benchmarks.synthetic import FakeProcessor, SyntheticDevices
+    from deviceinfocompare.compare import compare_device_list
+
+    # The migrations and diffs would be logged line by line otherwise
+    logging.disable(logging.INFO)
+
+    try:
+        generations = SyntheticDevices(size, churn, flip_rate)
+        processor = FakeProcessor(generations.devices)
+
+        timings = {
+            "enumerate": median_time(processor.get_current_devices, repeat),
+        }
+
+        dump_ids: List[int] = []
+        dump_times = []
+        for number in range(dump_count):
+            if number:
+                processor.devices = generations.next_generation()
+            dump_times.append(
+                time_call(
+                    lambda: dump_ids.append(
+                        processor.dump_devices(f"Synthetic dump {number}").id
+                    )
+                )
+            )
+        timings["dump_devices"] = statistics.median(dump_times)
+
+        old_devices = processor.get_devices_by_dump_id(dump_ids[0])
+        current_devices = generations.next_generation()
+        timings["compare_device_list"] = median_time(
+            lambda: compare_device_list(current_devices, old_devices), repeat
+        )
+
+        middle_dump_id = dump_ids[len(dump_ids) // 2]
+        timings["get_devices_by_dump_id"] = median_time(
+            lambda: list(processor.get_devices_by_dump_id(middle_dump_id)), repeat
+        )
+        timings["get_dump_list"] = median_time(processor.get_dump_list, repeat)
+        timings["remove_dump"] = time_call(
+            lambda: processor.remove_dump(middle_dump_id)
+        )
+        timings["clear_dumps"] = time_call(processor.clear_dumps)
+
+        return timings
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+
+    for size, timings in results["results"].items():
+        for operation, seconds in timings.items():
+            old_seconds = baseline["results"].get(size, {}).get(operation)
+            if old_seconds is None:
+                continue
+
+            if (
+                seconds > old_seconds * (1 + threshold)
+                and seconds - old_seconds > NOISE_FLOOR
+            ):
+                regressions.append(
+                    f"{operation} on {size} devices: {old_seconds * 1000:.1f} ms"
+                    f" -> {seconds * 1000:.1f} ms"
+                )
+
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[100, 1000, 10000, 100000],
+        help="comma separated device counts, 100,1000,10000,100000 by default",
+    )
+    argparser.add_argument("--dumps", type=int, default=5, help="dumps per size")
+    argparser.add_argument(
+        "--churn", type=float, default=0.01, help="share of devices replaced per dump"
+    )
+    argparser.add_argument(
+        "--flip-rate",
+        type=float,
+        default=0.01,
+        help="share of device statuses flipped per dump",
+    )
+    argparser.add_argument(
+        "--repeat", type=int, default=5, help="runs of every read-only operation"
+    )
+    argparser.add_argument(
+        "--storage-mode",
+        default=os.environ.get("DIC_STORAGE_MODE", "flat"),
+        help="flat, dedup or delta",
+    )
+    argparser.add_argument(
+        "-o", "--output", default="bench-results.json", help="the JSON results file"
+    )
+    argparser.add_argument("--baseline", help="a results file to compare with")
+    argparser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="how much slower than the baseline is a regression, 0.25 by default",
+    )
+    args = argparser.parse_args()
+
+    results = {
+        "created": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "dumps": args.dumps,
+            "churn": args.churn,
+            "flip_rate": args.flip_rate,
+            "repeat": args.repeat,
+            "storage_mode": args.storage_mode,
+        },
+        "results": {},
+    }
+
+    print(f"{'devices':>8}" + "".join(f"{op:>24}" for op in OPERATIONS))
+    for size in args.sizes:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            timings = executor.submit(
+                run_size,
+                size,
+                args.dumps,
+                args.churn,
+                args.flip_rate,
+                args.repeat,
+                args.storage_mode,
+            ).result()
+
+        results["results"][str(size)] = timings
+        print(
+            f"{size:>8}"
+            + "".join(f"{timings[op] * 1000:>21.2f} ms" for op in OPERATIONS)
+        )
+
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(results, file, indent=2)
+    print(f"The results were written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as file:
+            baseline = json.load(file)
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Checks that compares of stored dumps give what diff_device_lists gives
+
+Run from the repository root: python -m benchmarks.check_compare
+
+compare_dumps works the diff out in SQL, these compare it with the Python diff
+of the same device lists in every storage mode, unknown statuses included
+"""
+
+import functools
+import os
+import random
+import tempfile
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-check-")
+os.environ["DIC_SNAPSHOT_TTL"] = "0"
+
+from benchmarks.checks import Checks
+from benchmarks.synthetic import FakeProcessor, SyntheticDevices
+from deviceinfocompare.compare import DeviceDiff, diff_device_lists
+from deviceinfocompare.data import DeviceRecord
+
+check = Checks()
+
+
+@functools.lru_cache(maxsize=None)
+def get_processor() -> FakeProcessor:
+    return FakeProcessor()
+
+
+def diff_key(diff: DeviceDiff) -> tuple:
+    return (
+        diff.old_count,
+        diff.current_count,
+        *(
+            sorted(getattr(diff, name), key=repr)
+            for name in ("missing", "new", "broken", "fixed")
+        ),
+    )
+
+
+def check_pair(old_dump_id: int, current_dump_id: int) -> None:
+    processor = get_processor()
+    expected = diff_device_lists(
+        processor.get_devices_by_dump_id(current_dump_id),
+        processor.get_devices_by_dump_id(old_dump_id),
+    )
+
+    # The second compare is read from the compare cache
+    for _ in range(2):
+        diff = processor.compare_dumps(old_dump_id, current_dump_id)
+        assert diff_key(diff) == diff_key(expected), (
+            f"#{old_dump_id} -> #{current_dump_id} ({processor.storage_mode}): "
+            f"{diff_key(diff)} != {diff_key(expected)}"
+        )
+
+
+def save_dumps(storage_mode: str, device_lists) -> list:
+    processor = get_processor()
+    processor.storage_mode = storage_mode
+    return [
+        processor.save_dump(f"Check dump {number}", devices).id
+        for number, devices in enumerate(device_lists)
+    ]
+
+
+def check_unknown_statuses(storage_mode: str) -> None:
+    # NULL never matches in SQL, not even another NULL
+    unknown = DeviceRecord("A", "Unknown status", "USB", None)
+    other = DeviceRecord("B", "Other device", "USB", True)
+
+    for old_devices, current_devices in (
+        ([unknown, other], [other]),
+        ([other], [unknown, other]),
+        ([unknown._replace(device_status=True)], [unknown]),
+        ([unknown], [unknown._replace(device_status=False)]),
+        ([unknown, other], [unknown, other]),
+    ):
+        check_pair(*save_dumps(storage_mode, [old_devices, current_devices]))
+
+
+def check_synthetic_history(storage_mode: str) -> None:
+    randomizer = random.Random(7)
+    generations = SyntheticDevices(300, churn=0.05, flip_rate=0.05)
+
+    device_lists = [generations.devices]
+    for _ in range(4):
+        device_lists.append(
+            [
+                (
+                    device._replace(device_status=None)
+                    if randomizer.random() < 0.05
+                    else device
+                )
+                for device in generations.next_generation()
+            ]
+        )
+
+    dump_ids = save_dumps(storage_mode, device_lists)
+    for old_dump_id in dump_ids:
+        for current_dump_id in dump_ids:
+            check_pair(old_dump_id, current_dump_id)
+
+
+@check
+def unknown_statuses():
+    for storage_mode in FakeProcessor.STORAGE_MODES:
+        check_unknown_statuses(storage_mode)
+
+
+@check
+def synthetic_history():
+    for storage_mode in FakeProcessor.STORAGE_MODES:
+        check_synthetic_history(storage_mode)
+
+
+if __name__ == "__main__":
+    check.run()
@@ -0,0 +1,158 @@
+"""Checks of the enumeration host protocol against benchmarks/fake_host.py
+
+Run from the repository root: python -m benchmarks.check_host
+
+Covers streaming and plain results, errors, malformed output, a restart after
+the host died and a timeout of a stuck host. Exits with 1 if a check failed
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-check-")
+
+from benchmarks.checks import Checks, expect_error
+from deviceinfocompare.host import EnumerationHost, HostDied, HostError, HostTimeout
+
+FAKE_HOST = Path(__file__).with_name("fake_host.py")
+DEVICE_COUNT = 25
+
+check = Checks()
+
+
+def make_host(timeout: float = 5) -> EnumerationHost:
+    return EnumerationHost(
+        [sys.executable, str(FAKE_HOST), str(DEVICE_COUNT)], timeout=timeout
+    )
+
+
+@check
+def request_answers():
+    host = make_host()
+    try:
+        assert host.request("ping") == "pong"
+        assert host.request("ping") == "pong"
+    finally:
+        host.close()
+
+
+@check
+def stream_yields_every_record():
+    host = make_host()
+    try:
+        records = list(host.stream("enumerate"))
+        assert len(records) == DEVICE_COUNT, len(records)
+
+        # ConvertTo-Json may answer with one result instead of records
+        assert list(host.stream("enumerate", streamed=False)) == records
+    finally:
+        host.close()
+
+
+@check
+def windows_processor_reads_records():
+    from deviceinfocompare.processors import WindowsProcessor
+
+    processor = WindowsProcessor(host=make_host())
+    try:
+        devices = list(processor.enumerate_devices())
+        assert len(devices) == DEVICE_COUNT, len(devices)
+        assert devices[0].device_name is None
+        assert devices[0].device_status is False
+        assert devices[1].device_status is True
+    finally:
+        processor.host.close()
+
+
+@check
+def windows_processor_without_host_is_collected():
+    from deviceinfocompare.processors import WindowsProcessor
+
+    # What is left of a processor whose __init__ raised before the host was set
+    processor = WindowsProcessor.__new__(WindowsProcessor)
+    processor.__del__()
+
+
+@check
+def error_response_raises():
+    host = make_host()
+    try:
+        error = expect_error(HostError, lambda: host.request("unknown"))
+        assert "Unknown method" in str(error)
+        assert host.request("ping") == "pong"
+    finally:
+        host.close()
+
+
+@check
+def malformed_line_is_skipped():
+    host = make_host()
+    try:
+        assert host.request("noise") == "after noise"
+    finally:
+        host.close()
+
+
+@check
+def dead_host_is_restarted():
+    host = make_host()
+    try:
+        host.request("ping")
+        first_pid = host._process.pid
+
+        host._process.kill()
+        host._process.wait()
+
+        assert host.request("ping") == "pong"
+        assert host._process.pid != first_pid
+    finally:
+        host.close()
+
+
+@check
+def host_dying_twice_raises():
+    host = make_host()
+    try:
+        expect_error(HostDied, lambda: host.request("exit"))
+        assert host.request("ping") == "pong"
+    finally:
+        host.close()
+
+
+@check
+def stream_is_not_retried_after_records():
+    host = make_host()
+    try:
+        received = []
+        expect_error(
+            HostDied, lambda: received.extend(host.stream("enumerate", exit_after=3))
+        )
+        assert len(received) == 3, len(received)
+        assert len(list(host.stream("enumerate"))) == DEVICE_COUNT
+    finally:
+        host.close()
+
+
+@check
+def stuck_host_times_out():
+    host = make_host(timeout=0.5)
+    try:
+        host.request("ping")
+        stuck_pid = host._process.pid
+
+        start = time.monotonic()
+        expect_error(HostTimeout, lambda: host.request("sleep", seconds=30))
+        assert time.monotonic() - start < 5
+
+        # The stuck host was killed, the next request gets a fresh one
+        assert host.request("ping") == "pong"
+        assert host._process.pid != stuck_pid
+    finally:
+        host.close()
+
+
+if __name__ == "__main__":
+    check.run()
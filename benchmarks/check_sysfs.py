@@ -0,0 +1,223 @@
+"""Checks of LinuxProcessor against a small sysfs fixture tree
+
+Run from the repository root: python -m benchmarks.check_sysfs
+
+The tree is laid out like /sys: devices under devices/, bus/*/devices and
+class/*/* link to them, drivers are bound by a driver link. Covers the bus
+scan, uevent and modalias reading, driver links, PCI class parsing and the
+change fingerprint. Exits with 1 if a check failed
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+os.environ["DIC_BASE_DIR"] = tempfile.mkdtemp(prefix="dic-check-")
+
+from benchmarks.checks import Checks
+from deviceinfocompare.data import DeviceRecord
+from deviceinfocompare.processors import LinuxProcessor
+
+check = Checks()
+
+PCI_ROOT = "devices/pci0000:00"
+USB_PORT = f"{PCI_ROOT}/0000:00:14.0/usb1/1-1"
+
+
+def write_file(path: Path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf8")
+
+
+def link(path: Path, target: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.symlink(os.path.relpath(target, path.parent), path)
+
+
+def add_device(
+    root: Path,
+    device_path: str,
+    bus: str,
+    uevent: Dict[str, str],
+    driver: Optional[str] = None,
+    attrs: Optional[Dict[str, str]] = None,
+) -> Path:
+    device = root / device_path
+    write_file(
+        device / "uevent", "".join(f"{key}={value}\n" for key, value in uevent.items())
+    )
+    for name, value in (attrs or {}).items():
+        write_file(device / name, value + "\n")
+
+    link(device / "subsystem", root / "bus" / bus)
+    link(root / "bus" / bus / "devices" / device.name, device)
+    if driver is not None:
+        bind_driver(root, device_path, bus, driver)
+
+    return device
+
+
+def bind_driver(root: Path, device_path: str, bus: str, driver: str) -> None:
+    driver_dir = root / "bus" / bus / "drivers" / driver
+    driver_dir.mkdir(parents=True, exist_ok=True)
+    link(root / device_path / "driver", driver_dir)
+
+
+def add_class_device(root: Path, class_name: str, name: str, device_path: str) -> None:
+    class_device = root / device_path / class_name / name
+    class_device.mkdir(parents=True)
+    link(class_device / "device", root / device_path)
+    link(root / "class" / class_name / name, class_device)
+
+
+def make_tree() -> Path:
+    root = Path(tempfile.mkdtemp(prefix="dic-sysfs-"))
+
+    # A display controller, the class comes from PCI_CLASS
+    add_device(
+        root,
+        f"{PCI_ROOT}/0000:00:02.0",
+        "pci",
+        {"PCI_CLASS": "30000", "PCI_ID": "8086:9A49", "MODALIAS": "pci:v00008086"},
+        driver="i915",
+    )
+    # No driver for an audio device with a modalias, so it is broken
+    add_device(
+        root,
+        f"{PCI_ROOT}/0000:00:1f.3",
+        "pci",
+        {"PCI_CLASS": "40300", "PCI_ID": "8086:A0C8", "MODALIAS": "pci:v00008086"},
+    )
+    # A network controller, its /sys/class wins over PCI_CLASS
+    add_device(
+        root,
+        f"{PCI_ROOT}/0000:00:19.0",
+        "pci",
+        {"PCI_CLASS": "20000", "PCI_ID": "8086:15FA", "MODALIAS": "pci:v00008086"},
+        driver="e1000e",
+    )
+    add_class_device(root, "net", "eth0", f"{PCI_ROOT}/0000:00:19.0")
+    # A class the table does not know and a malformed one fall back to the bus
+    add_device(
+        root, f"{PCI_ROOT}/0000:00:1a.0", "pci", {"PCI_CLASS": "ff0000"}, driver="x"
+    )
+    add_device(root, f"{PCI_ROOT}/0000:00:1b.0", "pci", {"PCI_CLASS": "zz"}, driver="x")
+
+    # The modalias is only in its own attribute and the name in "product"
+    add_device(
+        root,
+        USB_PORT,
+        "usb",
+        {"DEVTYPE": "usb_device"},
+        attrs={"product": "USB Keyboard", "modalias": "usb:v046Dp C31C"},
+    )
+    # A quoted HID_NAME, there is no name attribute
+    add_device(
+        root,
+        f"{USB_PORT}/0003:046D:C31C.0001",
+        "hid",
+        {"HID_NAME": '"Logitech Keyboard"', "MODALIAS": "hid:b0003"},
+        driver="hid-generic",
+    )
+
+    # CPUs work without a driver, ACPI is skipped altogether
+    add_device(root, "devices/system/cpu/cpu0", "cpu", {"MODALIAS": "cpu:type:x86"})
+    add_device(root, "devices/LNXSYSTM:00", "acpi", {"MODALIAS": "acpi:LNXSYSTM:"})
+
+    return root
+
+
+EXPECTED = [
+    DeviceRecord("CPU\\cpu0", "cpu0", "cpu", True),
+    DeviceRecord("HID\\0003:046D:C31C.0001", "Logitech Keyboard", "hid", True),
+    DeviceRecord("PCI\\0000:00:02.0", "PCI device 8086:9A49", "Display", True),
+    DeviceRecord("PCI\\0000:00:19.0", "PCI device 8086:15FA", "net", True),
+    DeviceRecord("PCI\\0000:00:1a.0", "0000:00:1a.0", "pci", True),
+    DeviceRecord("PCI\\0000:00:1b.0", "0000:00:1b.0", "pci", True),
+    DeviceRecord("PCI\\0000:00:1f.3", "PCI device 8086:A0C8", "Multimedia", False),
+    DeviceRecord("USB\\1-1", "USB Keyboard", "usb", False),
+]
+
+
+@check
+def enumerates_every_bus_device():
+    processor = LinuxProcessor(sysfs_root=make_tree())
+
+    devices = list(processor.enumerate_devices())
+    assert devices == EXPECTED, devices
+
+
+@check
+def pci_class_parsing():
+    processor = LinuxProcessor(sysfs_root=make_tree())
+
+    assert processor._get_pci_class({"PCI_CLASS": "C0330"}) == "Serial bus"
+    assert processor._get_pci_class({"PCI_CLASS": "30000"}) == "Display"
+    assert processor._get_pci_class({"PCI_CLASS": "ff0000"}) is None
+    assert processor._get_pci_class({"PCI_CLASS": ""}) is None
+    assert processor._get_pci_class({}) is None
+
+
+@check
+def driver_link_changes_status_and_fingerprint():
+    root = make_tree()
+    processor = LinuxProcessor(sysfs_root=root)
+    monitor = processor.create_change_monitor()
+
+    assert not monitor.has_changed()
+    bind_driver(root, USB_PORT, "usb", "usbhid")
+    assert monitor.has_changed()
+    assert not monitor.has_changed()
+
+    devices = {device.device_id: device for device in processor.enumerate_devices()}
+    assert devices["USB\\1-1"].device_status is True
+
+
+@check
+def snapshot_is_dropped_after_a_change():
+    root = make_tree()
+    processor = LinuxProcessor(sysfs_root=root)
+    processor.snapshot.ttl = 60
+
+    assert processor.get_current_devices() == EXPECTED
+    assert processor.snapshot.get() is not None
+
+    add_device(root, "devices/system/cpu/cpu1", "cpu", {"MODALIAS": "cpu:type:x86"})
+    devices = processor.get_current_devices()
+    assert DeviceRecord("CPU\\cpu1", "cpu1", "cpu", True) in devices, devices
+
+
+@check
+def uevents_of_bus_and_class_devices():
+    root = make_tree()
+    processor = LinuxProcessor(sysfs_root=root)
+
+    [(device_id, record)] = processor.read_event_devices(
+        {"ACTION": "bind", "SUBSYSTEM": "pci", "DEVPATH": f"/{PCI_ROOT}/0000:00:1f.3"}
+    )
+    assert device_id == "PCI\\0000:00:1f.3" and record == EXPECTED[6], record
+
+    # A network interface event re-reads the PCI device it belongs to
+    [(device_id, record)] = processor.read_event_devices(
+        {
+            "ACTION": "add",
+            "SUBSYSTEM": "net",
+            "DEVPATH": f"/{PCI_ROOT}/0000:00:19.0/net/eth0",
+        }
+    )
+    assert record == EXPECTED[3], record
+
+    assert processor.read_event_devices(
+        {"ACTION": "remove", "SUBSYSTEM": "usb", "DEVPATH": f"/{PCI_ROOT}/usb1/1-9"}
+    ) == [("USB\\1-9", None)]
+    assert (
+        processor.read_event_devices(
+            {"ACTION": "add", "SUBSYSTEM": "acpi", "DEVPATH": "/devices/LNXSYSTM:00"}
+        )
+        == []
+    )
+
+
+if __name__ == "__main__":
+    check.run()
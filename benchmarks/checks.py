@@ -0,0 +1,45 @@
+"""What the check_* scripts share: a check is a function raising if it fails"""
+
+import logging
+import sys
+import time
+from typing import Callable, List
+
+
+class Checks(List[Callable[[], None]]):
+    """Decorate functions with an instance to collect them, run() runs them all"""
+
+    def __call__(self, fn: Callable[[], None]) -> Callable[[], None]:
+        self.append(fn)
+        return fn
+
+    def run(self) -> None:
+        """Print every result, exits with 1 if a check failed"""
+
+        # Restarts, retries and the like are logged as warnings on purpose
+        logging.disable(logging.WARNING)
+
+        failed = 0
+        for fn in self:
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                failed += 1
+                print(f"FAIL {fn.__name__}: {type(e).__name__}: {e}")
+            else:
+                print(
+                    f"ok   {fn.__name__} ({(time.perf_counter() - start) * 1000:.0f} ms)"
+                )
+
+        print(f"{len(self) - failed} of {len(self)} checks passed")
+        if failed:
+            sys.exit(1)
+
+
+def expect_error(error_type: type, fn: Callable) -> Exception:
+    try:
+        fn()
+    except error_type as e:
+        return e
+    raise AssertionError(f"{error_type.__name__} was not raised")
@@ -0,0 +1,74 @@
+"""A stand-in for the PowerShell enumeration host of WindowsProcessor
+
+Speaks the same JSON lines protocol on stdin/stdout, so EnumerationHost can be
+checked without Windows: python benchmarks/fake_host.py [DEVICE_COUNT]
+
+Besides "enumerate" and "ping" it has methods to misbehave on purpose:
+
+    sleep   answers after params["seconds"]
+    exit    exits without answering
+    noise   writes a line which is not JSON before answering
+"""
+
+import json
+import sys
+import time
+
+
+def write_response(response: dict) -> None:
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+
+def make_device(number: int) -> dict:
+    """A record shaped like Get-PnpDevice | Select-Object, some names are null"""
+
+    return {
+        "Status": "Error" if number % 10 == 0 else "OK",
+        "Class": "USB" if number % 2 else "System",
+        "FriendlyName": None if number % 7 == 0 else f"Fake device {number}",
+        "InstanceId": f"FAKE\\VEN_{number:04X}\\{number}",
+    }
+
+
+def handle(request: dict, device_count: int) -> None:
+    request_id = request["id"]
+    method = request["method"]
+    params = request.get("params") or {}
+
+    if method == "enumerate":
+        devices = [make_device(number) for number in range(device_count)]
+
+        # A plain result is what ConvertTo-Json of a whole list would give
+        if not params.get("streamed", True):
+            write_response({"id": request_id, "result": devices})
+            return
+
+        for number, device in enumerate(devices):
+            if number == params.get("exit_after"):
+                sys.exit(1)
+            write_response({"id": request_id, "record": device})
+        write_response({"id": request_id, "done": True})
+    elif method == "ping":
+        write_response({"id": request_id, "result": "pong"})
+    elif method == "sleep":
+        time.sleep(params.get("seconds", 60))
+        write_response({"id": request_id, "result": "slept"})
+    elif method == "exit":
+        sys.exit(1)
+    elif method == "noise":
+        sys.stdout.write("WARNING: this is not JSON\n")
+        write_response({"id": request_id, "result": "after noise"})
+    else:
+        write_response({"id": request_id, "error": f"Unknown method {method}"})
+
+
+def main():
+    device_count = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+
+    for line in sys.stdin:
+        handle(json.loads(line), device_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Deterministic synthetic devices and a processor enumerating them
+
+Import this only after DIC_BASE_DIR is set, it imports the processors
+"""
+
+import random
+from typing import Iterator, List, Sequence
+
+from deviceinfocompare.data import DeviceRecord
+from deviceinfocompare.monitor import PollingMonitor
+from deviceinfocompare.processors import BaseProcessor
+
+DEVICE_CLASSES = (
+    "System",
+    "USB",
+    "HIDClass",
+    "Display",
+    "Net",
+    "DiskDrive",
+    "AudioEndpoint",
+    "Processor",
+)
+
+
+def make_device(number: int, device_status: bool = True) -> DeviceRecord:
+    device_class = DEVICE_CLASSES[number % len(DEVICE_CLASSES)]
+    return DeviceRecord(
+        f"PCI\\VEN_{number % 0x10000:04X}&DEV_{number * 7919 % 0x10000:04X}\\{number}",
+        f"Synthetic {device_class} device {number}",
+        device_class,
+        device_status,
+    )
+
+
+class SyntheticDevices:
+    """Generations of a device list, every one is made from the previous
+
+    churn is the share of devices replaced by new ones and flip_rate the share
+    whose status flips between two generations, the same seed gives the same
+    generations
+    """
+
+    def __init__(
+        self, count: int, churn: float = 0.01, flip_rate: float = 0.01, seed: int = 42
+    ) -> None:
+        self.churn = churn
+        self.flip_rate = flip_rate
+        self._random = random.Random(seed)
+        self._next_number = count
+
+        self.devices: List[DeviceRecord] = [
+            make_device(number, self._random.random() >= flip_rate)
+            for number in range(count)
+        ]
+
+    def next_generation(self) -> List[DeviceRecord]:
+        devices = list(self.devices)
+        count = len(devices)
+
+        for index in self._random.sample(range(count), int(count * self.churn)):
+            devices[index] = make_device(self._next_number)
+            self._next_number += 1
+
+        for index in self._random.sample(range(count), int(count * self.flip_rate)):
+            devices[index] = devices[index]._replace(
+                device_status=not devices[index].device_status
+            )
+
+        self.devices = devices
+        return devices
+
+
+class FakeProcessor(BaseProcessor):
+    """Enumerates whatever device list it was given last"""
+
+    def __init__(self, devices: Sequence[DeviceRecord] = ()) -> None:
+        self.devices = devices
+        super().__init__()
+
+    def create_change_monitor(self):
+        # A new list is a hardware change, the snapshot must not outlive it
+        return PollingMonitor(lambda: id(self.devices))
+
+    def enumerate_devices(self) -> Iterator[DeviceRecord]:
+        yield from self.devices
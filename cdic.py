@@ -1,23 +1,167 @@
 import argparse
 import platform
-
-import colorama
-from tabulate import tabulate
+from typing import Optional
 
 import deviceinfocompare
-from deviceinfocompare.compare import compare_device_list
-from deviceinfocompare.processors import *
+
+# Modules which need SQLAlchemy and the database are imported by the commands
+# using them, so --version and --help start without them
+
+
+def print_storage_report(storage_report: dict) -> None:
+    from tabulate import tabulate
+
+    print(
+        tabulate(
+            [
+                ("Device rows in dumps", storage_report["device_rows"]),
+                ("Device rows stored", storage_report["stored_rows"]),
+                ("Rows saved by deduplication", storage_report["saved_rows"]),
+                ("Database bytes used", storage_report["used_bytes"]),
+                *(
+                    [("Database bytes saved", storage_report["saved_bytes"])]
+                    if "saved_bytes" in storage_report
+                    else []
+                ),
+            ]
+        )
+    )
+
+
+def format_events(events) -> str:
+    return ", ".join(f"#{event.dump_id} {event.kind}" for event in events)
+
+
+def print_history(history_scan) -> None:
+    from tabulate import tabulate
+
+    print(
+        tabulate(
+            [
+                (
+                    summary.dump_id,
+                    summary.datetime,
+                    summary.desc,
+                    summary.device_count,
+                    summary.new,
+                    summary.missing,
+                    summary.broken,
+                    summary.fixed,
+                )
+                for summary in history_scan
+            ],
+            headers=(
+                "ID",
+                "Datetime created",
+                "Description",
+                "Devices",
+                "New",
+                "Missing",
+                "Broken",
+                "Fixed",
+            ),
+        )
+    )
+
+    if history_scan.device_id is not None and not history_scan.devices:
+        print(
+            f"\nDevice {history_scan.device_id} was never dumped on {history_scan.host}"
+        )
+        return
+
+    changed_devices = [
+        history for history in history_scan.devices.values() if history.events
+    ]
+    if history_scan.device_id is None and not changed_devices:
+        print("\nNo device has ever changed")
+        return
+
+    print()
+    print(
+        tabulate(
+            [
+                (
+                    history.device_id,
+                    history.device_name,
+                    history.device_class,
+                    history.first_seen,
+                    history.last_seen,
+                    format_events(history.events),
+                )
+                for history in (changed_devices or history_scan.devices.values())
+            ],
+            headers=(
+                "Device ID",
+                "Name",
+                "Class",
+                "First seen",
+                "Last seen",
+                "Changes",
+            ),
+        )
+    )
+
+
+def watch(data_processor, dump_id: int, settle_time: Optional[float]) -> None:
+    from deviceinfocompare.compare import log_device_diff
+    from deviceinfocompare.watch import DeviceWatcher
+
+    if dump_id:
+        baseline = data_processor.get_devices_by_dump_id(dump_id)
+    else:
+        baseline = data_processor.get_devices_of_last_dump()
+
+    def on_settled(devices) -> None:
+        revision_info = data_processor.save_dump("Created while watching", devices)
+        print(f"Changes settled, dump with id {revision_info.id} was created")
+
+    watcher = DeviceWatcher(
+        data_processor, baseline, settle_time=settle_time, on_settled=on_settled
+    )
+    log_device_diff(watcher.start())
+
+    print("Watching for device changes, press Ctrl+C to stop")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def start_profiling(profile_file: Optional[str]):
+    """Measure the stages, and everything with cProfile if a file is given"""
+
+    from deviceinfocompare import profiling
+
+    profiling.enable()
+
+    if not profile_file:
+        return None
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiling(profiler, profile_file: Optional[str]) -> None:
+    from deviceinfocompare import profiling
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+
+    print()
+    print(profiling.format_breakdown())
+    if profiler is not None:
+        print(f"\nThe profile was written to {profile_file}, see python -m pstats")
 
 
 def main():
-    system_name = platform.system()
-    data_processor = None
+    if platform.system() == "Windows":
+        import colorama
 
-    if system_name == "Windows":
-        data_processor = WindowsProcessor()
         colorama.just_fix_windows_console()
-    else:
-        raise Exception(f"DIC can't work on {system_name} yet")
 
     argparser = argparse.ArgumentParser(
         description=f"""deviceinfocompare (dic) is the program created to help you to know if 
@@ -45,8 +189,8 @@ Just create a dump of you devices info data to compare with the result after ser
         "--remove",
         metavar="DUMP_ID",
         type=int,
-        nargs=1,
-        help="remove a dump with id specified",
+        nargs="+",
+        help="remove the dumps with ids specified",
     )
     argparser.add_argument(
         "-ca",
@@ -64,7 +208,7 @@ Just create a dump of you devices info data to compare with the result after ser
         "-c",
         "--compare",
         action="store_true",
-        help="compare current configuration to the newest dump",
+        help="compare current configuration to the newest dump of this machine",
     )
     argparser.add_argument(
         "-ct",
@@ -74,22 +218,144 @@ Just create a dump of you devices info data to compare with the result after ser
         nargs=1,
         help="compare current configuration to existing dump by entering its id",
     )
+    argparser.add_argument(
+        "-cd",
+        "--compare-dumps",
+        metavar=("OLD_DUMP_ID", "NEW_DUMP_ID"),
+        type=int,
+        nargs=2,
+        help="compare two existing dumps by entering their ids",
+    )
+    argparser.add_argument(
+        "--history",
+        metavar="DEVICE_ID",
+        type=str,
+        nargs="?",
+        const="",
+        help="print what changed in every dump and when the devices (or one device) changed",
+    )
+    argparser.add_argument(
+        "--host",
+        type=str,
+        help="the machine --history is printed for, this machine by default",
+    )
+    argparser.add_argument(
+        "--import",
+        dest="import_files",
+        metavar="FILE",
+        type=str,
+        nargs="+",
+        help="import the dumps of export files or other machines' deviceinfo.db files",
+    )
+    argparser.add_argument(
+        "--export",
+        metavar="DUMP_ID",
+        type=int,
+        nargs="*",
+        help="write the dumps with ids specified (all by default) to an export file",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        type=str,
+        default="dumps.dicx",
+        help="the export file, dumps.dicx by default",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="worker processes reading the imported files, one per CPU by default",
+    )
+    argparser.add_argument(
+        "--hosts",
+        action="store_true",
+        help="print the machines which have dumps in the database",
+    )
+    argparser.add_argument(
+        "--lost-class",
+        metavar="DEVICE_CLASS",
+        type=str,
+        help="print the hosts which lost a device of the class since their previous dump",
+    )
+    argparser.add_argument(
+        "--compare-hosts",
+        metavar=("OLD_HOST", "NEW_HOST"),
+        type=str,
+        nargs=2,
+        help="compare the newest dumps of two machines",
+    )
+    argparser.add_argument(
+        "-w",
+        "--watch",
+        metavar="DUMP_ID",
+        type=int,
+        nargs="?",
+        const=0,
+        help="print device changes against a dump (the newest of this machine by default) as they happen",
+    )
+    argparser.add_argument(
+        "--watch-dump",
+        metavar="SECONDS",
+        type=float,
+        help="while watching, create a dump once changes have settled for SECONDS",
+    )
+    argparser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="rebuild the database file to reclaim all the free space and exit",
+    )
+    argparser.add_argument(
+        "--storage-report",
+        action="store_true",
+        help="print how many device rows the deduplicated storage saves",
+    )
+    argparser.add_argument(
+        "--migrate-dedup",
+        action="store_true",
+        help="move all the dumps into the deduplicated storage and exit",
+    )
+    argparser.add_argument(
+        "--profile",
+        metavar="FILE",
+        type=str,
+        nargs="?",
+        const="",
+        help="print how long every stage of the command took, write a cProfile file if given",
+    )
     args = argparser.parse_args()
 
     if args.version:
         print(f"deviceinfocompare's version is {deviceinfocompare.__version__}")
-    elif args.dump:
+        return
+
+    profiler = None
+    if args.profile is not None:
+        profiler = start_profiling(args.profile)
+
+    from tabulate import tabulate
+
+    from deviceinfocompare.compare import compare_device_list, log_device_diff
+    from deviceinfocompare.processors import get_processor
+    from deviceinfocompare.profiling import span
+
+    with span("startup"):
+        data_processor = get_processor()
+
+    if args.dump:
         revision_info = data_processor.dump_devices(args.dump)
         print(
             f"Dump with id {revision_info.id} was created successfully at {revision_info.datetime}"
         )
     elif args.remove:
+        dump_ids_str = ", ".join(f"#{dump_id}" for dump_id in args.remove)
         user_answer = input(
-            f"Are you sure you want to delete dump #{args.remove[0]}? [y\\n]: "
+            f"Are you sure you want to delete dump(s) {dump_ids_str}? [y\\n]: "
         )
         if user_answer.lower().strip() == "y":
-            data_processor.remove_dump(args.remove[0])
-            print(f"Dump #{args.remove[0]} was removed successfully")
+            data_processor.remove_dumps(args.remove)
+            print(f"Dump(s) {dump_ids_str} were removed successfully")
         else:
             print("Delete cancelled")
     elif args.clear_all:
@@ -107,27 +373,79 @@ Just create a dump of you devices info data to compare with the result after ser
         elif len(dump_data_list) == 1:
             print(
                 tabulate(
-                    dump_data_list, headers=("ID", "Datetime created", "Description")
+                    dump_data_list,
+                    headers=("ID", "Datetime created", "Description", "Host"),
                 )
             )
             print("\nDatabase has 1 dump in total")
         else:
             print(
                 tabulate(
-                    dump_data_list, headers=("ID", "Datetime created", "Description")
+                    dump_data_list,
+                    headers=("ID", "Datetime created", "Description", "Host"),
                 )
             )
             print("\nDatabase has", len(dump_data_list), "dumps in total")
     elif args.compare:
         compare_device_list(
-            data_processor.get_current_devices(),
+            data_processor.iter_current_devices(),
             data_processor.get_devices_of_last_dump(),
         )
     elif args.compare_to:
         compare_device_list(
-            data_processor.get_current_devices(),
+            data_processor.iter_current_devices(),
             data_processor.get_devices_by_dump_id(args.compare_to[0]),
         )
+    elif args.compare_dumps:
+        log_device_diff(data_processor.compare_dumps(*args.compare_dumps))
+    elif args.import_files:
+        imported_count = data_processor.import_files(args.import_files, args.jobs)
+        print(f"{imported_count} dump(s) were imported")
+    elif args.export is not None:
+        data_processor.export_dumps(args.export or None, args.output)
+        print(f"The dumps were exported to {args.output}")
+    elif args.hosts:
+        print(
+            tabulate(
+                data_processor.get_hosts(),
+                headers=("Host", "Dumps", "Last dump ID", "Last dump datetime"),
+            )
+        )
+    elif args.lost_class:
+        lost_devices = data_processor.find_lost_devices(args.lost_class)
+        if lost_devices:
+            print(
+                tabulate(
+                    lost_devices,
+                    headers=(
+                        "Host",
+                        "Previous dump ID",
+                        "Dump ID",
+                        "Device ID",
+                        "Name",
+                    ),
+                )
+            )
+        else:
+            print(f"No host lost a device of class {args.lost_class}")
+    elif args.compare_hosts:
+        log_device_diff(data_processor.compare_hosts(*args.compare_hosts))
+    elif args.history is not None:
+        print_history(data_processor.get_history(args.history or None, args.host))
+    elif args.watch is not None:
+        watch(data_processor, args.watch, args.watch_dump)
+    elif args.vacuum:
+        data_processor.vacuum()
+        print("The database was vacuumed successfully")
+    elif args.storage_report:
+        print_storage_report(data_processor.get_storage_report())
+    elif args.migrate_dedup:
+        storage_report = data_processor.migrate_to_dedup()
+        print(f"{storage_report['migrated_dumps']} dump(s) were migrated")
+        print_storage_report(storage_report)
+
+    if args.profile is not None:
+        stop_profiling(profiler, args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import datetime
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.orm import Session
+
+from deviceinfocompare.compare import DeviceDiff
+from deviceinfocompare.data import CompareCacheEntry, DeviceRecord
+
+
+class LRUCache:
+    """Safe to share between threads"""
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return default
+
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class CompareCache:
+    """Diffs of stored dump pairs persisted in the database, evicted least recently used"""
+
+    DIFF_LISTS = ("missing", "new", "broken", "fixed")
+
+    def __init__(self, session: Session, maxsize: int = 64) -> None:
+        self.session = session
+        self.maxsize = maxsize
+
+    @classmethod
+    def _encode(cls, diff: DeviceDiff) -> bytes:
+        payload = {
+            "old_count": diff.old_count,
+            "current_count": diff.current_count,
+            **{
+                name: [tuple(d) for d in getattr(diff, name)] for name in cls.DIFF_LISTS
+            },
+        }
+        return zlib.compress(json.dumps(payload).encode("utf8"))
+
+    @classmethod
+    def _decode(cls, data: bytes) -> DeviceDiff:
+        payload = json.loads(zlib.decompress(data))
+        return DeviceDiff(
+            old_count=payload["old_count"],
+            current_count=payload["current_count"],
+            **{
+                name: [DeviceRecord._make(d) for d in payload[name]]
+                for name in cls.DIFF_LISTS
+            },
+        )
+
+    def get(self, left_dump_id: int, right_dump_id: int) -> Optional[DeviceDiff]:
+        if self.maxsize <= 0:
+            return None
+
+        entry = self.session.get(CompareCacheEntry, (left_dump_id, right_dump_id))
+        if entry is None:
+            return None
+
+        entry.last_used = datetime.datetime.utcnow()
+        diff = self._decode(entry.diff)
+        self.session.commit()
+
+        return diff
+
+    def put(self, left_dump_id: int, right_dump_id: int, diff: DeviceDiff) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self.session.merge(
+            CompareCacheEntry(
+                left_dump_id=left_dump_id,
+                right_dump_id=right_dump_id,
+                diff=self._encode(diff),
+                last_used=datetime.datetime.utcnow(),
+            )
+        )
+        self.session.flush()
+
+        oldest_kept = self.session.execute(
+            select(CompareCacheEntry.last_used)
+            .order_by(CompareCacheEntry.last_used.desc())
+            .offset(self.maxsize - 1)
+            .limit(1)
+        ).scalar()
+        if oldest_kept is not None:
+            self.session.execute(
+                delete(CompareCacheEntry).where(
+                    CompareCacheEntry.last_used < oldest_kept
+                )
+            )
+
+        self.session.commit()
+
+    def invalidate(self, dump_ids: Iterable[int]) -> None:
+        """Runs in the caller's transaction, so it goes away together with the dumps"""
+
+        dump_ids = list(dump_ids)
+        self.session.execute(
+            delete(CompareCacheEntry).where(
+                or_(
+                    CompareCacheEntry.left_dump_id.in_(dump_ids),
+                    CompareCacheEntry.right_dump_id.in_(dump_ids),
+                )
+            )
+        )
+
+    def clear(self) -> None:
+        self.session.execute(delete(CompareCacheEntry))
+
+
+class DeviceSnapshot:
+    """The last enumerated device list, valid for ttl seconds or until the change
+    monitor reports that the hardware has changed
+
+    Without a change monitor only the ttl applies, so it should be short. Safe to
+    share between threads
+    """
+
+    def __init__(self, ttl: float, change_monitor=None) -> None:
+        self.ttl = ttl
+        self.change_monitor = change_monitor
+
+        self._records: Optional[Tuple[DeviceRecord, ...]] = None
+        self._taken_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Tuple[DeviceRecord, ...]]:
+        with self._lock:
+            # Always drained, events from before an enumeration must not void its
+            # result
+            changed = (
+                self.change_monitor is not None and self.change_monitor.has_changed()
+            )
+
+            if self._records is None:
+                return None
+
+            if changed or time.monotonic() - self._taken_at > self.ttl:
+                self._records = None
+                return None
+
+            return self._records
+
+    def put(self, records: Sequence[DeviceRecord]) -> None:
+        if self.ttl <= 0:
+            return
+
+        records = tuple(records)
+        with self._lock:
+            self._records = records
+            self._taken_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._records = None
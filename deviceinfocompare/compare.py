@@ -1,126 +1,204 @@
 import logging
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List
+
+from sqlalchemy import Integer, except_, func, select, tuple_, type_coerce
+from sqlalchemy.orm import Session
+
+from deviceinfocompare.data import DeviceRecord, dump_device_view
+from deviceinfocompare.profiling import span
 
 logger = logging.getLogger(__name__)
 
 
-def device_list_has(device, device_list):
-    for devlist_device in device_list:
-        if device.device_id == devlist_device.device_id:
-            device_list.remove(devlist_device)
-            return True
-    return False
+@dataclass
+class DeviceDiff:
+    """Result of comparing an old device list to a current one
 
+    unchanged is only filled by diff_device_lists, diffs of stored dumps and diffs
+    restored from the compare cache leave it empty, use unchanged_count instead
+    """
 
-def state_changed(device, old_device_list):
-    for devlist_device in old_device_list:
-        if device.device_id == devlist_device.device_id:
-            if device.device_status != devlist_device.device_status:
-                return {
-                    "from": devlist_device.device_status,
-                    "to": device.device_status,
-                }
-            else:
-                return "no_changes"
-    return "not_found"
+    old_count: int = 0
+    current_count: int = 0
+    missing: List = field(default_factory=list)
+    new: List = field(default_factory=list)
+    broken: List = field(default_factory=list)
+    fixed: List = field(default_factory=list)
+    unchanged: List = field(default_factory=list)
 
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.missing or self.new or self.broken or self.fixed)
 
-def compare_device_list(current_devices, old_devices):
-    if callable(getattr(current_devices, "filter", None)):
-        current_devices = [obj for obj in current_devices.all()]
+    @property
+    def unchanged_count(self) -> int:
+        return self.current_count - len(self.new) - len(self.broken) - len(self.fixed)
 
-    if callable(getattr(old_devices, "filter", None)):
-        old_devices = [obj for obj in old_devices.all()]
 
-    device_total_change = len(current_devices) - len(old_devices)
-    if device_total_change == 0:
-        device_total_change = ""
-    elif device_total_change > 0:
-        device_total_change = "(" + f"+{device_total_change}" + ")"
-    else:
-        device_total_change = "(" + f"{device_total_change}" + ")"
+def _as_device_list(devices) -> List:
+    if callable(getattr(devices, "filter", None)):
+        return devices.all()
+    return list(devices)
 
-    logger.info(f"Previous device amount is {len(old_devices)}")
-    if device_total_change == "":
-        logger.info(f"[+] Current device amount is {len(current_devices)} too")
-    elif "+" in device_total_change:
-        logger.info(
-            f"[?] Current device amount is {len(current_devices)} {device_total_change}"
+
+def diff_device_lists(current_devices: Iterable, old_devices: Iterable) -> DeviceDiff:
+    """The current devices are consumed once, so they may be a generator which
+    is still enumerating"""
+
+    old_devices = _as_device_list(old_devices)
+    old_index = {device.device_id: device for device in old_devices}
+
+    diff = DeviceDiff(old_count=len(old_devices))
+
+    for device in current_devices:
+        diff.current_count += 1
+        old_device = old_index.pop(device.device_id, None)
+
+        if old_device is None:
+            diff.new.append(device)
+        elif device.device_status == old_device.device_status:
+            diff.unchanged.append(device)
+        elif device.device_status:
+            diff.fixed.append(device)
+        else:
+            diff.broken.append(device)
+
+    # Whatever was not matched by the current list is missing now
+    diff.missing = list(old_index.values())
+
+    return diff
+
+
+def _count_dump_rows(session: Session, dump_id: int) -> int:
+    return session.execute(
+        select(func.count())
+        .select_from(dump_device_view)
+        .where(dump_device_view.c.dump_id == dump_id)
+    ).scalar()
+
+
+def _iter_rows_not_in(
+    session: Session, dump_id: int, other_dump_id: int
+) -> Iterator[DeviceRecord]:
+    """Rows of the dump whose device is not in the other dump or has another
+    status there"""
+
+    # NULL IN (...) is never true, so an unknown status is compared as -1
+    status = func.coalesce(type_coerce(dump_device_view.c.device_status, Integer), -1)
+
+    def device_states(state_dump_id: int):
+        return select(dump_device_view.c.device_id, status).where(
+            dump_device_view.c.dump_id == state_dump_id
         )
-    else:
-        logger.info(
-            f"[-] Current device amount is {len(current_devices)} {device_total_change}"
+
+    # Both sides are read once each into a temporary b-tree, a correlated
+    # lookup through the view would not be served by an index for every storage
+    changed_states = except_(device_states(dump_id), device_states(other_dump_id))
+
+    rows = session.execute(
+        select(
+            dump_device_view.c.device_id,
+            dump_device_view.c.device_name,
+            dump_device_view.c.device_class,
+            dump_device_view.c.device_status,
         )
+        .where(dump_device_view.c.dump_id == dump_id)
+        .where(tuple_(dump_device_view.c.device_id, status).in_(changed_states))
+        .order_by(dump_device_view.c.device_id)
+    )
+    for row in rows:
+        yield DeviceRecord._make(row)
+
 
-    # Looking for missing devices
-    missing_devices = []
+def diff_stored_dumps(
+    session: Session, old_dump_id: int, current_dump_id: int
+) -> DeviceDiff:
+    """diff_device_lists of two stored dumps worked out by the database, only the
+    rows which differ are read"""
 
-    current_devices_copy = current_devices.copy()
+    diff = DeviceDiff(
+        old_count=_count_dump_rows(session, old_dump_id),
+        current_count=_count_dump_rows(session, current_dump_id),
+    )
 
-    for old_device in old_devices:
-        if not device_list_has(old_device, current_devices_copy):
-            missing_devices.append(old_device)
+    old_changes = list(_iter_rows_not_in(session, old_dump_id, current_dump_id))
+    old_ids = {device.device_id for device in old_changes}
+    current_ids = set()
 
-    if len(missing_devices) != 0:
+    for device in _iter_rows_not_in(session, current_dump_id, old_dump_id):
+        current_ids.add(device.device_id)
+
+        if device.device_id not in old_ids:
+            diff.new.append(device)
+        elif device.device_status:
+            diff.fixed.append(device)
+        else:
+            diff.broken.append(device)
+
+    diff.missing = [
+        device for device in old_changes if device.device_id not in current_ids
+    ]
+
+    return diff
+
+
+def _log_device_list(devices) -> None:
+    for count, dev in enumerate(devices):
         logger.info(
-            f"[-] {len(missing_devices)} device(s) are missing. These are: ",
+            f"{count + 1}. {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
         )
-        for count, dev in enumerate(missing_devices):
-            logger.info(
-                f"{count + 1}. {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
-            )
-    else:
-        logger.info("[+] No devices are missing, hooray!")
-
-    # Looking for new devices
-    new_devices = []
 
-    old_devices_copy = old_devices.copy()
 
-    for new_device in current_devices:
-        if not device_list_has(new_device, old_devices_copy):
-            new_devices.append(new_device)
+def log_device_diff(diff: DeviceDiff) -> None:
+    device_total_change = diff.current_count - diff.old_count
 
-    if len(new_devices) != 0:
-        logger.info(f"[?] {len(new_devices)} device(s) are new. These are: ")
-        for count, dev in enumerate(new_devices):
-            logger.info(
-                f"{count + 1}. {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
-            )
+    logger.info(f"Previous device amount is {diff.old_count}")
+    if device_total_change == 0:
+        logger.info(f"[+] Current device amount is {diff.current_count} too")
+    elif device_total_change > 0:
+        logger.info(
+            f"[?] Current device amount is {diff.current_count} (+{device_total_change})"
+        )
     else:
-        logger.info("[?] No new devices found")
-
-    # Looking for fixed/broken devices
-    fixed_devices = []
-    broken_devices = []
+        logger.info(
+            f"[-] Current device amount is {diff.current_count} ({device_total_change})"
+        )
 
-    for new_device in current_devices:
-        chng_state = state_changed(new_device, old_devices)
-        if chng_state == "not_found" or chng_state == "no_changes":
-            continue
+    if len(diff.missing) != 0:
+        logger.info(
+            f"[-] {len(diff.missing)} device(s) are missing. These are: ",
+        )
+        _log_device_list(diff.missing)
+    else:
+        logger.info("[+] No devices are missing, hooray!")
 
-        if chng_state["to"] == True:
-            fixed_devices.append(new_device)
-        elif chng_state["to"] == False:
-            broken_devices.append(new_device)
+    if len(diff.new) != 0:
+        logger.info(f"[?] {len(diff.new)} device(s) are new. These are: ")
+        _log_device_list(diff.new)
+    else:
+        logger.info("[?] No new devices found")
 
-    if len(broken_devices) != 0:
+    if len(diff.broken) != 0:
         logger.info(
-            f"[-] {len(broken_devices)} device(s) are broken since dump. These are: "
+            f"[-] {len(diff.broken)} device(s) are broken since dump. These are: "
         )
-        for count, dev in enumerate(broken_devices):
-            logger.info(
-                f"{count + 1}. {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
-            )
+        _log_device_list(diff.broken)
     else:
         logger.info("[+] No devices are broken since dump")
 
-    if len(fixed_devices) != 0:
+    if len(diff.fixed) != 0:
         logger.info(
-            f"[+] {len(fixed_devices)} device(s) are fixed since dump. These are: "
+            f"[+] {len(diff.fixed)} device(s) are fixed since dump. These are: "
         )
-        for count, dev in enumerate(fixed_devices):
-            logger.info(
-                f"{count + 1}. {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
-            )
+        _log_device_list(diff.fixed)
     else:
         logger.info("[-] No devices are fixed since dump")
+
+
+def compare_device_list(current_devices, old_devices) -> DeviceDiff:
+    with span("compare.diff"):
+        diff = diff_device_lists(current_devices, old_devices)
+    with span("compare.log"):
+        log_device_diff(diff)
+    return diff
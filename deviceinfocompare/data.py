@@ -1,15 +1,45 @@
-from sqlalchemy import Boolean, String, Column, DateTime, Integer, ForeignKey
+from typing import NamedTuple
+
+from sqlalchemy import (
+    Boolean,
+    String,
+    Column,
+    DateTime,
+    Integer,
+    ForeignKey,
+    LargeBinary,
+    column,
+    table,
+)
 from sqlalchemy.ext.declarative import declarative_base
 
 DeclarativeBase = declarative_base()
 
 
+class SchemaVersion(DeclarativeBase):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    datetime = Column(DateTime)
+    desc = Column(String)
+
+
 class Dump(DeclarativeBase):
     __tablename__ = "dump"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     datetime = Column(DateTime)
     desc = Column(String)
+    host = Column(String)  # The machine the dump was made on
+
+
+class DeviceRecord(NamedTuple):
+    """A device state detached from the ORM, what processors and compare work with"""
+
+    device_id: str
+    device_name: str
+    device_class: str
+    device_status: bool
 
 
 class Device(DeclarativeBase):
@@ -21,3 +51,66 @@ class Device(DeclarativeBase):
     device_class = Column(String)
     device_status = Column(Boolean)
     dump_id = Column(Integer, ForeignKey("dump.id"))
+
+
+class StoredDevice(DeclarativeBase):
+    """A unique device state shared by every dump it was seen in"""
+
+    __tablename__ = "device_record"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    hash = Column(String, unique=True)
+    device_name = Column(String)
+    device_id = Column(String)
+    device_class = Column(String)
+    device_status = Column(Boolean)
+
+
+class DumpMembership(DeclarativeBase):
+    __tablename__ = "dump_membership"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    dump_id = Column(Integer, ForeignKey("dump.id"), primary_key=True)
+    record_id = Column(Integer, ForeignKey("device_record.id"), primary_key=True)
+
+
+class DumpDelta(DeclarativeBase):
+    """Marks a dump stored as changes against a full (checkpoint) dump"""
+
+    __tablename__ = "dump_delta"
+
+    dump_id = Column(Integer, ForeignKey("dump.id"), primary_key=True)
+    base_dump_id = Column(Integer, ForeignKey("dump.id"))
+
+
+class DeltaDevice(DeclarativeBase):
+    __tablename__ = "delta_device"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    dump_id = Column(Integer, ForeignKey("dump_delta.dump_id"))
+    change = Column(String)  # "added", "removed" or "changed"
+    device_name = Column(String)
+    device_id = Column(String)
+    device_class = Column(String)
+    device_status = Column(Boolean)
+
+
+class CompareCacheEntry(DeclarativeBase):
+    __tablename__ = "compare_cache"
+
+    left_dump_id = Column(Integer, ForeignKey("dump.id"), primary_key=True)
+    right_dump_id = Column(Integer, ForeignKey("dump.id"), primary_key=True)
+    diff = Column(LargeBinary)  # zlib compressed JSON
+    last_used = Column(DateTime, index=True)
+
+
+# Every device row of every dump whatever storage the dump uses, a view made by
+# migration v4, so it is not part of the declarative metadata
+dump_device_view = table(
+    "dump_device",
+    column("dump_id", Integer),
+    column("device_id", String),
+    column("device_name", String),
+    column("device_class", String),
+    column("device_status", Boolean),
+)
@@ -0,0 +1,252 @@
+"""The .dicx exchange format, dumps moved between machines
+
+A file is MAGIC followed by a zlib stream of records. Every record is a tag
+byte, the varint length of its payload and the payload, so readers can skip
+tags they don't know:
+
+    H  JSON header: format and schema version of the writer
+    D  JSON dump metadata: host, datetime and description, starts a dump
+    S  UTF-8 string, gets the next string index of the file
+    R  device: varint string indexes of id, name and class, a status byte
+    E  ends the current dump
+
+Since format 2 string index 0 is None and the strings start at 1, a status
+byte of 2 is None too. Format 1 files have no None values
+"""
+
+import datetime
+import json
+import logging
+import zlib
+from typing import IO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from deviceinfocompare.data import DeviceRecord
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DICX\x01"
+FORMAT_VERSION = 2
+
+TAG_HEADER = b"H"
+TAG_DUMP = b"D"
+TAG_STRING = b"S"
+TAG_DEVICE = b"R"
+TAG_END = b"E"
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class DumpInfo(NamedTuple):
+    host: str
+    datetime: datetime.datetime
+    desc: str
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varint(data: bytes, pos: int = 0) -> Tuple[int, int]:
+    """Return the value and the position after it"""
+
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _record(tag: bytes, payload: bytes) -> bytes:
+    return tag + encode_varint(len(payload)) + payload
+
+
+def _json_record(tag: bytes, value: dict) -> bytes:
+    return _record(tag, json.dumps(value).encode("utf8"))
+
+
+def iter_export_chunks(
+    dumps: Iterable[Tuple[DumpInfo, Iterable[DeviceRecord]]], schema_version: int
+) -> Iterator[bytes]:
+    """Encode dumps into the bytes of a file, nothing is kept but the string table"""
+
+    compressor = zlib.compressobj(9)
+    strings: Dict[Optional[str], int] = {None: 0}  # None is never written
+
+    def records() -> Iterator[bytes]:
+        yield _json_record(
+            TAG_HEADER,
+            {"format": FORMAT_VERSION, "schema_version": schema_version},
+        )
+
+        for dump_info, devices in dumps:
+            yield _json_record(
+                TAG_DUMP,
+                {
+                    "host": dump_info.host,
+                    "datetime": dump_info.datetime.isoformat(),
+                    "desc": dump_info.desc,
+                },
+            )
+
+            for device in devices:
+                refs = bytearray()
+                for value in device[:3]:
+                    index = strings.get(value)
+                    if index is None:
+                        index = strings[value] = len(strings)
+                        yield _record(TAG_STRING, value.encode("utf8"))
+                    refs += encode_varint(index)
+                refs.append(2 if device[3] is None else 1 if device[3] else 0)
+
+                yield _record(TAG_DEVICE, bytes(refs))
+
+            yield _record(TAG_END, b"")
+
+    yield MAGIC
+    for record in records():
+        chunk = compressor.compress(record)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def write_export(
+    file: IO[bytes],
+    dumps: Iterable[Tuple[DumpInfo, Iterable[DeviceRecord]]],
+    schema_version: int,
+) -> None:
+    for chunk in iter_export_chunks(dumps, schema_version):
+        file.write(chunk)
+
+
+def is_export_file(file: IO[bytes]) -> bool:
+    """Peek at the magic, the file position is restored"""
+
+    position = file.tell()
+    try:
+        return file.read(len(MAGIC)) == MAGIC
+    finally:
+        file.seek(position)
+
+
+class ExportReader:
+    """Decodes an export file lazily
+
+    Iterating it yields (DumpInfo, devices) pairs, the devices are an iterator
+    that has to be consumed before the next dump is taken
+    """
+
+    def __init__(self, file: IO[bytes]) -> None:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise Exception("Not a deviceinfocompare export file")
+
+        self.file = file
+        self.header: Optional[dict] = None
+
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b""
+        self._pos = 0
+        self._strings: List[Optional[str]] = []
+
+    def _fill(self, size: int) -> bool:
+        """Make sure size bytes past the read position are decompressed"""
+
+        while len(self._buffer) - self._pos < size:
+            if self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            elif self._decompressor.eof:
+                return False
+            else:
+                data = self.file.read(READ_CHUNK_SIZE)
+                if not data:
+                    return False
+
+            # Dropping what was read keeps the buffer around one chunk
+            self._buffer = self._buffer[self._pos :] + self._decompressor.decompress(
+                data, READ_CHUNK_SIZE
+            )
+            self._pos = 0
+
+        return True
+
+    def _read_record(self) -> Optional[Tuple[bytes, bytes]]:
+        if not self._fill(1):
+            return None
+
+        # A varint length takes at most 10 bytes, fewer near the end
+        self._fill(11)
+        tag = self._buffer[self._pos : self._pos + 1]
+        length, payload_pos = decode_varint(self._buffer, self._pos + 1)
+        header_size = payload_pos - self._pos
+
+        if not self._fill(header_size + length):
+            raise Exception("The export file is truncated")
+
+        payload_pos = self._pos + header_size
+        payload = self._buffer[payload_pos : payload_pos + length]
+        self._pos = payload_pos + length
+
+        return tag, payload
+
+    def _iter_devices(self) -> Iterator[DeviceRecord]:
+        strings = self._strings
+
+        while True:
+            record = self._read_record()
+            if record is None:
+                raise Exception("The export file ends in the middle of a dump")
+
+            tag, payload = record
+            if tag == TAG_STRING:
+                strings.append(payload.decode("utf8"))
+            elif tag == TAG_DEVICE:
+                device_id, pos = decode_varint(payload)
+                device_name, pos = decode_varint(payload, pos)
+                device_class, pos = decode_varint(payload, pos)
+                yield DeviceRecord(
+                    strings[device_id],
+                    strings[device_name],
+                    strings[device_class],
+                    None if payload[pos] == 2 else bool(payload[pos]),
+                )
+            elif tag == TAG_END:
+                return
+
+    def __iter__(self) -> Iterator[Tuple[DumpInfo, Iterator[DeviceRecord]]]:
+        while True:
+            record = self._read_record()
+            if record is None:
+                return
+
+            tag, payload = record
+            if tag == TAG_HEADER:
+                self.header = json.loads(payload)
+                if self.header["format"] > FORMAT_VERSION:
+                    raise Exception(
+                        f"The export file format v{self.header['format']} is newer than this program"
+                    )
+                if self.header["format"] >= 2:
+                    self._strings.append(None)
+            elif tag == TAG_STRING:
+                self._strings.append(payload.decode("utf8"))
+            elif tag == TAG_DUMP:
+                meta = json.loads(payload)
+                devices = self._iter_devices()
+                yield DumpInfo(
+                    meta["host"],
+                    datetime.datetime.fromisoformat(meta["datetime"]),
+                    meta["desc"],
+                ), devices
+                # Whatever the caller left of the dump
+                for _ in devices:
+                    pass
+            else:
+                logger.debug(f"Skipping an unknown export record {tag!r}")
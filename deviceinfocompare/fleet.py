@@ -0,0 +1,201 @@
+import datetime
+import itertools
+import logging
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Union
+
+import sqlalchemy
+from sqlalchemy import and_, exists, func, select, text
+from sqlalchemy.orm import Session
+
+from deviceinfocompare.data import DeviceRecord, Dump, dump_device_view
+
+logger = logging.getLogger(__name__)
+
+
+class ImportedDump(NamedTuple):
+    """A dump read from another machine's file, ready to be saved here"""
+
+    host: str
+    datetime: datetime.datetime
+    desc: str
+    devices: List[DeviceRecord]
+
+
+class HostInfo(NamedTuple):
+    host: str
+    dump_count: int
+    last_dump_id: int
+    last_datetime: datetime.datetime
+
+
+class LostDevice(NamedTuple):
+    host: str
+    prev_dump_id: int
+    dump_id: int
+    device_id: str
+    device_name: str
+
+
+def guess_host(path: Union[str, Path]) -> str:
+    """hosts/pc-042/deviceinfo.db and hosts/pc-042.db both mean pc-042"""
+
+    path = Path(path).resolve()
+    if path.stem == "deviceinfo":
+        return path.parent.name
+    return path.stem
+
+
+def _to_device_record(row) -> DeviceRecord:
+    # Plain SQL gives the status back as 0 or 1
+    device_id, device_name, device_class, device_status = row
+    return DeviceRecord(
+        device_id,
+        device_name,
+        device_class,
+        None if device_status is None else bool(device_status),
+    )
+
+
+def read_database_file(path: Union[str, Path]) -> List[ImportedDump]:
+    """Read every dump of another deviceinfo.db, run in a worker process
+
+    Imports nothing from settings, so spawned workers don't open our own database
+    """
+
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///file:{Path(path).resolve()}?mode=ro&uri=true"
+    )
+
+    try:
+        with engine.connect() as conn:
+            names = {
+                row[0]
+                for row in conn.execute(
+                    text(
+                        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"
+                    )
+                )
+            }
+            if "dump" not in names:
+                raise Exception(f"{path} is not a deviceinfocompare database")
+
+            # Databases made before the views only ever had flat dumps
+            rows_source = "dump_device" if "dump_device" in names else "device"
+            columns = [row[1] for row in conn.execute(text("PRAGMA table_info(dump)"))]
+            host_column = "host" if "host" in columns else "NULL"
+
+            dumps = conn.execute(
+                text(f"SELECT id, datetime, desc, {host_column} FROM dump ORDER BY id")
+            ).all()
+            rows = conn.execute(
+                text(
+                    "SELECT dump_id, device_id, device_name, device_class, device_status "
+                    f"FROM {rows_source} ORDER BY dump_id"
+                )
+            )
+            rows_by_dump = {
+                dump_id: [_to_device_record(row[1:]) for row in dump_rows]
+                for dump_id, dump_rows in itertools.groupby(
+                    rows, key=lambda row: row[0]
+                )
+            }
+    finally:
+        engine.dispose()
+
+    default_host = guess_host(path)
+
+    return [
+        ImportedDump(
+            host=dump_host or default_host,
+            datetime=(
+                datetime.datetime.fromisoformat(dump_datetime)
+                if isinstance(dump_datetime, str)
+                else dump_datetime
+            ),
+            desc=dump_desc,
+            devices=rows_by_dump.get(dump_id, []),
+        )
+        for dump_id, dump_datetime, dump_desc, dump_host in dumps
+    ]
+
+
+def get_hosts(session: Session) -> List[HostInfo]:
+    last_dumps = (
+        select(
+            Dump.host,
+            func.count(Dump.id).label("dump_count"),
+            func.max(Dump.id).label("last_dump_id"),
+        )
+        .group_by(Dump.host)
+        .subquery()
+    )
+
+    return [
+        HostInfo._make(row)
+        for row in session.execute(
+            select(
+                last_dumps.c.host,
+                last_dumps.c.dump_count,
+                last_dumps.c.last_dump_id,
+                Dump.datetime,
+            )
+            .join(Dump, Dump.id == last_dumps.c.last_dump_id)
+            .order_by(last_dumps.c.host)
+        )
+    ]
+
+
+def get_last_dump_id(session: Session, host: str) -> Optional[int]:
+    return (
+        session.query(Dump.id)
+        .filter(Dump.host == host)
+        .order_by(Dump.id.desc())
+        .limit(1)
+        .scalar()
+    )
+
+
+def find_lost_devices(session: Session, device_class: str) -> List[LostDevice]:
+    """Devices of the class every host had in its previous dump but not in its last"""
+
+    ranked = select(
+        Dump.id,
+        Dump.host,
+        func.row_number()
+        .over(partition_by=Dump.host, order_by=Dump.id.desc())
+        .label("rank"),
+    ).subquery()
+    last, prev = ranked.alias("last_dump"), ranked.alias("prev_dump")
+
+    previous_device = dump_device_view.alias("previous_device")
+    last_device = dump_device_view.alias("last_device")
+
+    query = (
+        select(
+            last.c.host,
+            prev.c.id,
+            last.c.id,
+            previous_device.c.device_id,
+            previous_device.c.device_name,
+        )
+        .select_from(last)
+        .join(prev, and_(prev.c.host == last.c.host, prev.c.rank == 2))
+        .join(
+            previous_device,
+            and_(
+                previous_device.c.dump_id == prev.c.id,
+                previous_device.c.device_class == device_class,
+            ),
+        )
+        .where(last.c.rank == 1)
+        .where(
+            ~exists().where(
+                last_device.c.dump_id == last.c.id,
+                last_device.c.device_id == previous_device.c.device_id,
+            )
+        )
+        .order_by(last.c.host, previous_device.c.device_id)
+    )
+
+    return [LostDevice._make(row) for row in session.execute(query)]
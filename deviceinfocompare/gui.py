@@ -1,71 +1,165 @@
-import datetime
+import collections
+import html
 import logging
 import os
-import platform
 import re
 import sys
+import threading
 import webbrowser
-from typing import Optional, Union
+from typing import Optional
 
 from PyQt6 import QtGui, QtWidgets, uic
-from PyQt6.QtCore import QObject, QStringListModel, Qt, QThread, pyqtSignal
-from PyQt6.QtWidgets import QListView, QMessageBox, QTextEdit
-from showinfm import show_in_file_manager
+from PyQt6.QtCore import (
+    QObject,
+    Qt,
+    QTimer,
+    pyqtSignal,
+    pyqtSlot,
+)
+from PyQt6.QtWidgets import (
+    QListView,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QTextEdit,
+)
 
 import deviceinfocompare
-from deviceinfocompare.compare import compare_device_list
-from deviceinfocompare.processors import *
-from deviceinfocompare.settings import BASE_DIR, LOGGING, RESOURCE_PATH
+from deviceinfocompare import profiling
+from deviceinfocompare.compare import DeviceDiff, compare_device_list, log_device_diff
+from deviceinfocompare.gui_models import DiffProxyModel, DiffTableModel, DumpListModel
+from deviceinfocompare.jobs import Job, JobScheduler
+from deviceinfocompare.settings import (
+    BASE_DIR,
+    DEBUG,
+    LOG_VIEW_MAX_LINES,
+    LOGGING,
+    RESOURCE_PATH,
+    closeDB,
+    get_session_factory,
+    setup_logging,
+)
+from deviceinfocompare.watch import DeviceWatcher
 
 logger = logging.getLogger(__name__)
 
 
-def strip_s_ms(dt_in: Union[str, datetime.datetime]):
-    dt_in = str(dt_in)
-    return re.sub(r":\d+\.\d+$", "", dt_in)
+# The last sign found in this order picks the color of a line
+COLOR_SIGNS = (
+    ("WARNING", "darkorange"),
+    ("ERROR", "red"),
+    ("-", "red"),
+    ("+", "green"),
+    ("?", "darkorange"),
+    ("DEBUG", "magenta"),
+)
+COLOR_SIGN_RE = re.compile(
+    r"\[(" + "|".join(re.escape(sign) for sign, _ in COLOR_SIGNS) + r")\]"
+)
 
 
-class QTextEditLogger(logging.Handler):
-    def __init__(self, textedit_widget: QTextEdit):
-        super().__init__()
+def get_line_color(msg: str) -> str:
+    found_signs = set(COLOR_SIGN_RE.findall(msg))
+    for sign, color in reversed(COLOR_SIGNS):
+        if sign in found_signs:
+            return color
+    return ""
+
+
+class LogSink(QObject):
+    """Collects log lines from any thread and appends them to the widget in batches"""
+
+    FLUSH_INTERVAL_MS = 100
+    MAX_FLUSH_LINES = 500  # Per flush, so a flood never blocks the UI for long
+
+    records_ready = pyqtSignal()
+
+    def __init__(self, textedit_widget: QTextEdit, max_lines: int) -> None:
+        super().__init__(textedit_widget)
         self.widget = textedit_widget
-        self.widget.setReadOnly(True)
+        self.widget.document().setMaximumBlockCount(max_lines)
 
-        formatter = logging.Formatter(LOGGING["formatters"]["standard"]["format"])
-        self.setFormatter(formatter)
+        # Bounded too, so a flood while the UI is busy can't pile up
+        self._pending = collections.deque(maxlen=max_lines)
+        self._lock = threading.Lock()
 
-    def emit(self, record):
-        COLOR_SIGNS = (
-            ("[WARNING]", "darkorange"),
-            ("[ERROR]", "red"),
-            ("[-]", "red"),
-            ("[+]", "green"),
-            ("[?]", "darkorange"),
-            ("[DEBUG]", "magenta"),
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+        self.records_ready.connect(
+            self.scheduleFlush, Qt.ConnectionType.QueuedConnection
         )
 
-        text_color = ""
-        msg = self.format(record)
+    def push(self, msg: str) -> None:
+        with self._lock:
+            was_empty = not self._pending
+            self._pending.append(msg)
+
+        # One signal per batch, the timer collects the rest
+        if was_empty:
+            self.records_ready.emit()
+
+    @pyqtSlot()
+    def scheduleFlush(self) -> None:
+        if not self.timer.isActive():
+            self.timer.start(self.FLUSH_INTERVAL_MS)
+
+    @pyqtSlot()
+    def flush(self) -> None:
+        with self._lock:
+            msgs = [
+                self._pending.popleft()
+                for _ in range(min(len(self._pending), self.MAX_FLUSH_LINES))
+            ]
+            if self._pending:
+                self.timer.start(0)
+
+        if not msgs:
+            return
 
-        for sign, color in COLOR_SIGNS:
-            if sign in msg:
-                text_color = color
+        scroll_bar = self.widget.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
 
-        text_color_attrib = "" if text_color == "" else f'style="color: {text_color};"'
+        with profiling.span("gui.log_flush"):
+            cursor = QtGui.QTextCursor(self.widget.document())
+            cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+            cursor.beginEditBlock()
 
-        self.widget.append(f"<span {text_color_attrib}>{msg}</span>")
-        self.widget.verticalScrollBar().setValue(
-            self.widget.verticalScrollBar().maximum()
-        )
+            for msg in msgs:
+                text_color = get_line_color(msg)
+                text_color_attrib = (
+                    "" if text_color == "" else f'style="color: {text_color};"'
+                )
+
+                msg_html = html.escape(msg).replace("\n", "<br>")
+
+                if not self.widget.document().isEmpty():
+                    cursor.insertBlock()
+                cursor.insertHtml(f"<span {text_color_attrib}>{msg_html}</span>")
+
+            cursor.endEditBlock()
+
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+
+class QTextEditLogger(logging.Handler):
+    def __init__(self, textedit_widget: QTextEdit, max_lines: int = LOG_VIEW_MAX_LINES):
+        super().__init__()
+        self.widget = textedit_widget
+        self.widget.setReadOnly(True)
+        self.sink = LogSink(textedit_widget, max_lines)
 
+        formatter = logging.Formatter(LOGGING["formatters"]["standard"]["format"])
+        self.setFormatter(formatter)
 
-class TryWorker(QObject):
-    def run(self):
+    def emit(self, record):
+        # Formatted in the logging thread, the widget is only touched by the sink
         try:
-            return self.worker_fn()
-        except:
-            logger.exception("")
-            sys.exit(-1)
+            self.sink.push(self.format(record))
+        except Exception:
+            self.handleError(record)
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -74,6 +168,8 @@ class MainWindow(QtWidgets.QMainWindow):
         db_dir = os.path.join(BASE_DIR, "deviceinfo.db")
         logger.debug(db_dir)
 
+        from showinfm import show_in_file_manager
+
         show_in_file_manager(
             db_dir,
             open_not_select_directory=True,
@@ -81,52 +177,20 @@ class MainWindow(QtWidgets.QMainWindow):
         )
 
     def on_event_addPushButton_clicked(self):
-        class Worker(TryWorker):
-            finished = pyqtSignal()
-
-            def __init__(self, *args, **kwargs):
-                self.data_processor = kwargs.pop("data_processor")
-                self.title = kwargs.pop("title")
-                super().__init__(*args, **kwargs)
-
-            def worker_fn(self):
-                self.data_processor.dump_devices(self.title)
-                self.finished.emit()
-
         title = self.dumpTitleLineEdit.text().strip() or "Unnamed dump"
 
-        self.add_dump_thread = QThread()
-        self.add_dump_worker = Worker(data_processor=self.data_processor, title=title)
-        self.add_dump_worker.moveToThread(self.add_dump_thread)
+        def make_dump(job: Job):
+            devices = job.track(job.processor.iter_current_devices())
+            dump = job.processor.save_dump(title, devices)
+            return dump.id
 
-        self.add_dump_thread.started.connect(self.add_dump_worker.run)
-        self.add_dump_worker.finished.connect(self.add_dump_thread.quit)
-        self.add_dump_worker.finished.connect(self.add_dump_worker.deleteLater)
-        self.add_dump_thread.finished.connect(self.add_dump_thread.deleteLater)
+        job = Job(f"Making dump '{title}'", make_dump, read_only=False)
+        job.succeeded.connect(self.onDumpCreated)
 
         logger.info(f"Started making dump '{title}', please, wait...")
-        self.setAllControlsEnabled(False)
-        self.add_dump_thread.start()
-
-        self.add_dump_thread.finished.connect(lambda: self.populateDumpLists())
-        self.add_dump_thread.finished.connect(lambda: self.setAllControlsEnabled(True))
-        self.add_dump_thread.finished.connect(
-            lambda: logger.info("The new dump has been created!")
-        )
+        self.startJob(job)
 
     def on_event_deletePushButton_clicked(self):
-        class Worker(TryWorker):
-            finished = pyqtSignal()
-
-            def __init__(self, *args, **kwargs):
-                self.data_processor = kwargs.pop("data_processor")
-                self.dump_id = kwargs.pop("dump_id")
-                super().__init__(*args, **kwargs)
-
-            def worker_fn(self):
-                self.data_processor.remove_dump(self.dump_id)
-                self.finished.emit()
-
         dump_id = self.getDumpIDfromListView(self.leftListView)
 
         if dump_id == None:
@@ -138,60 +202,17 @@ class MainWindow(QtWidgets.QMainWindow):
             )
             return
 
-        self.delete_dump_thread = QThread()
-        self.delete_dump_worker = Worker(
-            data_processor=self.data_processor, dump_id=dump_id
-        )
-        self.delete_dump_worker.moveToThread(self.delete_dump_thread)
+        def delete_dump(job: Job):
+            job.processor.remove_dump(dump_id)
+            return dump_id
 
-        self.delete_dump_thread.started.connect(self.delete_dump_worker.run)
-        self.delete_dump_worker.finished.connect(self.delete_dump_thread.quit)
-        self.delete_dump_worker.finished.connect(self.delete_dump_worker.deleteLater)
-        self.delete_dump_thread.finished.connect(self.delete_dump_thread.deleteLater)
+        job = Job(f"Deleting dump #{dump_id}", delete_dump, read_only=False)
+        job.succeeded.connect(self.onDumpDeleted)
 
         logger.info(f"Started deleting dump with id {dump_id}")
-        self.setAllControlsEnabled(False)
-        self.delete_dump_thread.start()
-
-        self.delete_dump_thread.finished.connect(lambda: self.populateDumpLists())
-        self.delete_dump_thread.finished.connect(
-            lambda: self.setAllControlsEnabled(True)
-        )
-        self.delete_dump_thread.finished.connect(
-            lambda: logger.info("The dump has been deleted successfully!")
-        )
+        self.startJob(job)
 
     def on_event_comparePushButton_clicked(self):
-        class Worker(TryWorker):
-            finished = pyqtSignal()
-
-            def __init__(self, *args, **kwargs):
-                self.data_processor = kwargs.pop("data_processor")
-                self.left_dump_id = kwargs.pop("left_dump_id")
-                self.right_dump_id = kwargs.pop("right_dump_id")
-                super().__init__(*args, **kwargs)
-
-            def worker_fn(self):
-                device_seq_left = None
-                if self.left_dump_id == 0:
-                    device_seq_left = self.data_processor.get_current_devices()
-                else:
-                    device_seq_left = self.data_processor.get_devices_by_dump_id(
-                        self.left_dump_id
-                    )
-
-                device_seq_right = None
-                if self.right_dump_id == 0:
-                    device_seq_right = self.data_processor.get_current_devices()
-                else:
-                    device_seq_right = self.data_processor.get_devices_by_dump_id(
-                        self.right_dump_id
-                    )
-
-                compare_device_list(device_seq_right, device_seq_left)
-
-                self.finished.emit()
-
         left_id = self.getDumpIDfromListView(self.leftListView)
         right_id = self.getDumpIDfromListView(self.rightListView)
 
@@ -205,33 +226,116 @@ class MainWindow(QtWidgets.QMainWindow):
             logger.error("Cannot compare the same dumps, stopping")
             return
 
-        self.compare_dump_thread = QThread()
-        self.compare_dump_worker = Worker(
-            data_processor=self.data_processor,
-            left_dump_id=left_id,
-            right_dump_id=right_id,
-        )
-        self.compare_dump_worker.moveToThread(self.compare_dump_thread)
+        def get_devices(job: Job, dump_id: int):
+            if dump_id == 0:
+                return job.track(job.processor.iter_current_devices())
+            return job.processor.get_devices_by_dump_id(dump_id)
 
-        self.compare_dump_thread.started.connect(self.compare_dump_worker.run)
-        self.compare_dump_worker.finished.connect(self.compare_dump_thread.quit)
-        self.compare_dump_worker.finished.connect(self.compare_dump_worker.deleteLater)
-        self.compare_dump_thread.finished.connect(self.compare_dump_thread.deleteLater)
+        def compare(job: Job) -> DeviceDiff:
+            if left_id != 0 and right_id != 0:
+                diff = job.processor.compare_dumps(left_id, right_id)
+                log_device_diff(diff)
+                return diff
+
+            device_seq_left = get_devices(job, left_id)
+            job.check_cancelled()
+            return compare_device_list(get_devices(job, right_id), device_seq_left)
+
+        job = Job(f"Comparing dumps #{left_id} and #{right_id}", compare)
+        job.succeeded.connect(self.onDiffReady)
 
         logger.info(f"Started comparing dumps #{left_id} and #{right_id}")
-        self.setAllControlsEnabled(False)
-        self.compare_dump_thread.start()
+        self.startJob(job)
+
+    def on_event_watchPushButton_toggled(self, checked: bool):
+        if not checked:
+            if self.watch_job is not None:
+                # Enabled back once the watch job has really finished
+                self.watchPushButton.setEnabled(False)
+                self.watch_job.cancel()
+            return
+
+        dump_id = self.getDumpIDfromListView(self.leftListView)
+
+        if dump_id == None or dump_id == 0:
+            logger.error("Select a dump on the left panel to watch changes against")
+            self.watchPushButton.setChecked(False)
+            return
+
+        def watch(job: Job):
+            watcher = DeviceWatcher(
+                job.processor, job.processor.get_devices_by_dump_id(dump_id)
+            )
+            job.on_cancel(watcher.stop)
+
+            log_device_diff(watcher.start())
+            logger.info("Watching for device changes...")
+            watcher.run()
+
+        self.watch_job = Job(f"Watching device changes against dump #{dump_id}", watch)
+        self.watch_job.finished.connect(self.onWatchStopped)
 
-        self.compare_dump_thread.finished.connect(lambda: self.populateDumpLists())
-        self.compare_dump_thread.finished.connect(
-            lambda: self.setAllControlsEnabled(True)
+        logger.info(f"Started watching device changes against dump #{dump_id}")
+        self.startJob(self.watch_job)
+
+    def on_event_cancelJobsPushButton_clicked(self):
+        for job in self.scheduler.jobs:
+            if job is not self.watch_job:
+                job.cancel()
+
+    # endregion
+
+    # region Jobs
+    def startJob(self, job: Job) -> None:
+        job.progress.connect(self.onJobProgress)
+        job.failed.connect(self.onJobFailed)
+        # Picks up the dumps of other processes too, cdic or an import
+        job.finished.connect(self.dump_list_model.fetchNewDumps)
+        self.scheduler.submit(job)
+
+    def onJobProgress(self, done: int, total: int):
+        self.statusBar().showMessage(
+            f"{self.sender().name}: {done}" + (f" of {total}" if total else "")
         )
-        self.compare_dump_thread.finished.connect(
-            lambda: logger.info("The dumps have been compared successfully")
+
+    def onJobFailed(self, error: str):
+        self.err_msg.setText(f"{self.sender().name} has failed:\n{error}")
+        self.err_msg.show()
+
+    def onJobsChanged(self):
+        # The watch job has its own button
+        running_count = sum(
+            1 for job in self.scheduler.jobs if job is not self.watch_job
         )
 
+        self.jobProgressBar.setVisible(running_count > 0)
+        self.cancelJobsPushButton.setVisible(running_count > 0)
+        if running_count == 0:
+            self.statusBar().clearMessage()
+
+    def onDumpCreated(self, dump_id: int):
+        logger.info(f"The new dump #{dump_id} has been created!")
+
+    def onDumpDeleted(self, dump_id: int):
+        self.dump_list_model.removeDump(dump_id)
+        logger.info("The dump has been deleted successfully!")
+
+    def onDiffReady(self, diff: DeviceDiff):
+        self.showDiff(diff)
+        logger.info("The dumps have been compared successfully")
+
+    def onWatchStopped(self):
+        self.watch_job = None
+        self.watchPushButton.setChecked(False)
+        self.watchPushButton.setEnabled(True)
+        logger.info("Stopped watching device changes")
+
     # endregion
 
+    def showDiff(self, diff: DeviceDiff):
+        self.diff_model.setDiff(diff)
+        self.resultsTabWidget.setCurrentWidget(self.diffTab)
+
     def connectEvents(self):
         self.revealDBPushButton.clicked.connect(
             self.on_event_revealDBPushButton_clicked
@@ -239,55 +343,28 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addPushButton.clicked.connect(self.on_event_addPushButton_clicked)
         self.deletePushButton.clicked.connect(self.on_event_deletePushButton_clicked)
         self.comparePushButton.clicked.connect(self.on_event_comparePushButton_clicked)
-
-    def populateDumpLists(self):
-        self.leftListView.setModel(QStringListModel())
-        self.rightListView.setModel(QStringListModel())
-
-        dump_data_list = reversed(self.data_processor.get_dump_list())
-        entries = (
-            f"#0 [{strip_s_ms(datetime.datetime.utcnow())}] Current device list",
-            *[f"#{i[0]} [{strip_s_ms(i[1])}] {i[2]}" for i in dump_data_list],
+        self.watchPushButton.toggled.connect(self.on_event_watchPushButton_toggled)
+        self.cancelJobsPushButton.clicked.connect(
+            self.on_event_cancelJobsPushButton_clicked
         )
-
-        model = QStringListModel()
-        model.setStringList(entries)
-
-        self.entries = entries
-        self.leftListView.setModel(model)
-        self.rightListView.setModel(model)
-
-    def setAllControlsEnabled(self, desired_state: bool = True) -> None:
-        for button in (
-            self.comparePushButton,
-            self.deletePushButton,
-            self.addPushButton,
-            self.leftListView,
-            self.rightListView,
-            self.revealDBPushButton,
-            self.dumpTitleLineEdit,
-        ):
-            button.setEnabled(desired_state)
+        self.diffFilterLineEdit.textChanged.connect(self.diff_proxy_model.setFilterText)
 
     def getDumpIDfromListView(self, list_view: QListView) -> Optional[int]:
-        item_val = list_view.currentIndex().data()
-
-        if item_val == None:
-            return None
-
-        return int(re.search(r"(?<=#)\d+(?=\s)", item_val).group())
+        return list_view.currentIndex().data(Qt.ItemDataRole.UserRole)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         uic.loadUi(os.path.join(RESOURCE_PATH, "ui", "deviceinfocompare.ui"), self)
 
-        system_name = platform.system()
-        self.data_processor = None
+        # The stages of every background job are logged at DEBUG level
+        if DEBUG:
+            profiling.enable()
+
+        # SQLAlchemy and the platform's processor load with the window, not gui.py
+        from deviceinfocompare.processors import get_processor
 
-        if system_name == "Windows":
-            self.data_processor = WindowsProcessor()
-        else:
-            raise Exception(f"DIC can't work on {system_name} yet")
+        self.data_processor = get_processor()
+        self.watch_job: Optional[Job] = None
 
         # region Configuring logger
         logTextBox = QTextEditLogger(self.loggingTextEdit)
@@ -313,9 +390,50 @@ class MainWindow(QtWidgets.QMainWindow):
         )
         # endregion
 
-        self.populateDumpLists()
+        # region Configuring diff table
+        self.diff_model = DiffTableModel(self)
+        self.diff_proxy_model = DiffProxyModel(self)
+        self.diff_proxy_model.setSourceModel(self.diff_model)
+
+        self.diffTableView.setModel(self.diff_proxy_model)
+        self.diffTableView.verticalHeader().setVisible(False)
+        self.diffTableView.horizontalHeader().setStretchLastSection(True)
+        # Keep the order of the diff until a column is clicked
+        self.diffTableView.horizontalHeader().setSortIndicator(
+            -1, Qt.SortOrder.AscendingOrder
+        )
+        # endregion
+
+        # region Configuring jobs
+        self.scheduler = JobScheduler(
+            self.data_processor, get_session_factory(), parent=self
+        )
+        self.scheduler.jobs_changed.connect(self.onJobsChanged)
+
+        self.jobProgressBar = QProgressBar()
+        self.jobProgressBar.setRange(0, 0)  # Busy, how much is left is not known
+        self.jobProgressBar.setMaximumWidth(150)
+        self.cancelJobsPushButton = QPushButton("Cancel")
+        self.statusBar().addPermanentWidget(self.jobProgressBar)
+        self.statusBar().addPermanentWidget(self.cancelJobsPushButton)
+        self.onJobsChanged()
+        # endregion
+
+        # region Configuring dump lists
+        # Both panels page the same rows in as they are scrolled
+        self.dump_list_model = DumpListModel(self.data_processor, self)
+        self.leftListView.setModel(self.dump_list_model)
+        self.rightListView.setModel(self.dump_list_model)
+        # endregion
+
         self.connectEvents()
 
+    def closeEvent(self, e):
+        self.scheduler.cancel_all()
+        self.scheduler.wait()
+        closeDB()
+        super().closeEvent(e)
+
     def keyPressEvent(self, e):
         if e.key() == Qt.Key.Key_F1:
             webbrowser.open("https://github.com/alex-rusakevich/deviceinfocompare")
@@ -326,10 +444,10 @@ class MainWindow(QtWidgets.QMainWindow):
             self.setWindowTitle("I ❤️❤️❤️ you! :D")
 
 
-app = QtWidgets.QApplication(sys.argv)
-window = MainWindow()
-
-
 def run_ui():
+    setup_logging()
+
+    app = QtWidgets.QApplication(sys.argv)
+    window = MainWindow()
     window.show()
     app.exec()
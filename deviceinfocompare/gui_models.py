@@ -0,0 +1,267 @@
+import bisect
+import datetime
+import platform
+import re
+from typing import Any, List, Optional, Tuple, Union
+
+from PyQt6 import QtGui
+from PyQt6.QtCore import (
+    QAbstractListModel,
+    QAbstractTableModel,
+    QModelIndex,
+    QSortFilterProxyModel,
+    Qt,
+)
+
+from deviceinfocompare.compare import DeviceDiff
+
+
+def strip_s_ms(dt_in: Union[str, datetime.datetime]):
+    dt_in = str(dt_in)
+    return re.sub(r":\d+\.\d+$", "", dt_in)
+
+
+class DumpListModel(QAbstractListModel):
+    """Dumps newest first after the current device list (#0), loaded page by page
+
+    The dump id of a row is its UserRole data
+    """
+
+    FETCH_PAGE_SIZE = 100
+
+    def __init__(self, data_processor, parent=None) -> None:
+        super().__init__(parent)
+        self.data_processor = data_processor
+
+        # (id, datetime, desc, host) of every loaded row
+        self._rows: List[tuple] = [
+            (0, datetime.datetime.utcnow(), "Current device list", platform.node())
+        ]
+        self._all_fetched = False
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return not parent.isValid() and not self._all_fetched
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        if parent.isValid() or self._all_fetched:
+            return
+
+        # Keyset paging, the last loaded id is where the next page starts
+        last_id = self._rows[-1][0] if len(self._rows) > 1 else None
+        page = self.data_processor.get_dump_page(last_id, self.FETCH_PAGE_SIZE)
+        self._all_fetched = len(page) < self.FETCH_PAGE_SIZE
+
+        if page:
+            self.beginInsertRows(
+                QModelIndex(), len(self._rows), len(self._rows) + len(page) - 1
+            )
+            self._rows.extend(page)
+            self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+
+        dump_id, dump_datetime, dump_desc, dump_host = self._rows[index.row()]
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"#{dump_id} [{strip_s_ms(dump_datetime)}] {dump_host}: {dump_desc}"
+        elif role == Qt.ItemDataRole.UserRole:
+            return dump_id
+
+        return None
+
+    def fetchNewDumps(self) -> None:
+        """Load the dumps made since the newest loaded one, wherever they were made"""
+
+        if len(self._rows) == 1 and not self._all_fetched:
+            return  # Nothing is loaded yet, fetchMore gets the newest page anyway
+
+        newest_id = self._rows[1][0] if len(self._rows) > 1 else 0
+        rows = self.data_processor.get_dump_page(after_id=newest_id, limit=None)
+
+        if rows:
+            self.beginInsertRows(QModelIndex(), 1, len(rows))
+            self._rows[1:1] = rows
+            self.endInsertRows()
+
+    def removeDump(self, dump_id: int) -> None:
+        for row, (row_dump_id, *_) in enumerate(self._rows):
+            if row_dump_id == dump_id and row_dump_id != 0:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._rows[row]
+                self.endRemoveRows()
+                return
+
+
+class DiffTableModel(QAbstractTableModel):
+    """The changes of a DeviceDiff as table rows, handed to the view page by page
+
+    Rows are not copied, a row number is resolved to its diff list on demand
+    """
+
+    FETCH_PAGE_SIZE = 1000
+
+    HEADERS = ("Change", "Name", "Class", "Device ID")
+
+    # Diff lists shown and the names and colors of their rows
+    CHANGES = (
+        ("missing", "Missing", "red"),
+        ("new", "New", "darkorange"),
+        ("broken", "Broken", "red"),
+        ("fixed", "Fixed", "green"),
+    )
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._lists: List[List] = []
+        self._offsets: List[int] = []  # The first row of every list
+        self._order: Optional[List[int]] = None  # Row permutation once sorted
+        self._total_rows = 0
+        self._loaded_rows = 0
+
+        self._colors = [
+            QtGui.QBrush(QtGui.QColor(color)) for _, _, color in self.CHANGES
+        ]
+
+    def setDiff(self, diff: Optional[DeviceDiff]) -> None:
+        self.beginResetModel()
+
+        self._lists, self._offsets, self._order = [], [], None
+        self._total_rows = 0
+        if diff is not None:
+            for attr, _, _ in self.CHANGES:
+                self._offsets.append(self._total_rows)
+                self._lists.append(getattr(diff, attr))
+                self._total_rows += len(self._lists[-1])
+
+        self._loaded_rows = min(self._total_rows, self.FETCH_PAGE_SIZE)
+
+        self.endResetModel()
+
+    def _locate(self, row: int) -> Tuple[int, Any]:
+        if self._order is not None:
+            row = self._order[row]
+        change = bisect.bisect_right(self._offsets, row) - 1
+        return change, self._lists[change][row - self._offsets[change]]
+
+    def _get_value(self, row: int, column: int) -> str:
+        change, device = self._locate(row)
+
+        if column == 0:
+            return self.CHANGES[change][1]
+        elif column == 1:
+            return device.device_name
+        elif column == 2:
+            return device.device_class
+        else:
+            return device.device_id
+
+    def rowContains(self, row: int, text: str) -> bool:
+        """Whether any column has the lowercase text"""
+
+        change, device = self._locate(row)
+        return (
+            text in self.CHANGES[change][1].lower()
+            or text in (device.device_name or "").lower()
+            or text in (device.device_class or "").lower()
+            or text in (device.device_id or "").lower()
+        )
+
+    def sortRows(self, column: int, order: Qt.SortOrder) -> None:
+        """Sort every row, loaded or not, a negative column restores the diff order"""
+
+        self.beginResetModel()
+
+        self._order = None
+        if column >= 0:
+            self._order = sorted(
+                range(self._total_rows),
+                key=lambda row: (self._get_value(row, column) or "").lower(),
+                reverse=order == Qt.SortOrder.DescendingOrder,
+            )
+
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._loaded_rows
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return not parent.isValid() and self._loaded_rows < self._total_rows
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        if parent.isValid():
+            return
+
+        count = min(self.FETCH_PAGE_SIZE, self._total_rows - self._loaded_rows)
+        self.beginInsertRows(
+            QModelIndex(), self._loaded_rows, self._loaded_rows + count - 1
+        )
+        self._loaded_rows += count
+        self.endInsertRows()
+
+    def fetchAll(self) -> None:
+        if self.canFetchMore(QModelIndex()):
+            self.beginInsertRows(QModelIndex(), self._loaded_rows, self._total_rows - 1)
+            self._loaded_rows = self._total_rows
+            self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded_rows:
+            return None
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._get_value(index.row(), index.column())
+        elif role == Qt.ItemDataRole.ForegroundRole and index.column() == 0:
+            return self._colors[self._locate(index.row())[0]]
+
+        return None
+
+    def headerData(
+        self,
+        section: int,
+        orientation: Qt.Orientation,
+        role: int = Qt.ItemDataRole.DisplayRole,
+    ):
+        if (
+            orientation == Qt.Orientation.Horizontal
+            and role == Qt.ItemDataRole.DisplayRole
+        ):
+            return self.HEADERS[section]
+        return None
+
+
+class DiffProxyModel(QSortFilterProxyModel):
+    """Sorts and filters a DiffTableModel
+
+    Comparing rows one by one through data() is far too slow for big diffs, so
+    sorting is left to the source and filtering uses its plain Python rows
+    """
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._filter_text = ""
+
+    def sort(
+        self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder
+    ) -> None:
+        self.sourceModel().sortRows(column, order)
+
+    def setFilterText(self, text: str) -> None:
+        self._filter_text = text.strip().lower()
+
+        # Rows not fetched yet would be missing from the result
+        if self._filter_text:
+            self.sourceModel().fetchAll()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+        return not self._filter_text or self.sourceModel().rowContains(
+            source_row, self._filter_text
+        )
@@ -0,0 +1,153 @@
+import datetime
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from deviceinfocompare.data import Dump, dump_device_view
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryEvent(NamedTuple):
+    """A device change in a dump against the dumps before it
+
+    The kinds are those of DeviceDiff: "new", "missing", "broken" or "fixed"
+    """
+
+    dump_id: int
+    kind: str
+
+
+@dataclass
+class DeviceHistory:
+    device_id: str
+    device_name: str
+    device_class: str
+    first_seen: int
+    last_seen: int
+    device_status: bool
+    events: List[HistoryEvent] = field(default_factory=list)
+
+
+@dataclass
+class DumpSummary:
+    dump_id: int
+    datetime: datetime.datetime
+    desc: str
+    device_count: int = 0
+    new: int = 0
+    missing: int = 0
+    broken: int = 0
+    fixed: int = 0
+
+
+class HistoryScan:
+    """Device history over the dumps of one host, worked out by a single scan in
+    dump order
+
+    Iterating it yields the summary of every dump as soon as that dump has been
+    scanned, the histories of the devices are complete in devices afterwards
+    """
+
+    def __init__(
+        self, session: Session, host: str, device_id: Optional[str] = None
+    ) -> None:
+        self.session = session
+        self.host = host
+        self.device_id = device_id
+        self.devices: Dict[str, DeviceHistory] = {}
+
+    def _iter_rows(self) -> Iterator:
+        query = (
+            select(
+                dump_device_view.c.dump_id,
+                dump_device_view.c.device_id,
+                dump_device_view.c.device_name,
+                dump_device_view.c.device_class,
+                dump_device_view.c.device_status,
+            )
+            .where(
+                dump_device_view.c.dump_id.in_(
+                    select(Dump.id).where(Dump.host == self.host)
+                )
+            )
+            .order_by(dump_device_view.c.dump_id)
+        )
+
+        if self.device_id is not None:
+            query = query.where(dump_device_view.c.device_id == self.device_id)
+
+        return iter(self.session.execute(query))
+
+    def _add_event(
+        self, summary: DumpSummary, history: DeviceHistory, kind: str
+    ) -> None:
+        history.events.append(HistoryEvent(summary.dump_id, kind))
+        setattr(summary, kind, getattr(summary, kind) + 1)
+
+    def __iter__(self) -> Iterator[DumpSummary]:
+        self.devices = {}
+        present_before = set()
+
+        rows_by_dump = itertools.groupby(self._iter_rows(), key=lambda row: row[0])
+        next_group = next(rows_by_dump, None)
+
+        dumps = self.session.execute(
+            select(Dump.id, Dump.datetime, Dump.desc)
+            .where(Dump.host == self.host)
+            .order_by(Dump.id)
+        ).all()
+
+        for dump_number, (dump_id, dump_datetime, dump_desc) in enumerate(dumps):
+            summary = DumpSummary(dump_id, dump_datetime, dump_desc)
+            present = set()
+
+            rows = []
+            if next_group is not None and next_group[0] == dump_id:
+                # A group is gone once groupby moves on
+                rows = list(next_group[1])
+                next_group = next(rows_by_dump, None)
+
+            for _, device_id, device_name, device_class, device_status in rows:
+                present.add(device_id)
+                summary.device_count += 1
+
+                history = self.devices.get(device_id)
+                if history is None:
+                    history = self.devices[device_id] = DeviceHistory(
+                        device_id,
+                        device_name,
+                        device_class,
+                        first_seen=dump_id,
+                        last_seen=dump_id,
+                        device_status=device_status,
+                    )
+                    # Everything is new in the very first dump
+                    if dump_number:
+                        self._add_event(summary, history, "new")
+                    continue
+
+                if device_id not in present_before:
+                    self._add_event(summary, history, "new")
+
+                if device_status != history.device_status:
+                    self._add_event(
+                        summary, history, "fixed" if device_status else "broken"
+                    )
+
+                history.device_name = device_name
+                history.device_class = device_class
+                history.device_status = device_status
+                history.last_seen = dump_id
+
+            for device_id in present_before - present:
+                self._add_event(summary, self.devices[device_id], "missing")
+
+            present_before = present
+            yield summary
+
+        logger.debug(f"Scanned the history of {len(self.devices)} device(s)")
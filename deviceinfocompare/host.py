@@ -0,0 +1,210 @@
+import itertools
+import json
+import logging
+import queue
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+from deviceinfocompare.profiling import span
+from deviceinfocompare.settings import HOST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class HostError(Exception):
+    pass
+
+
+class HostDied(HostError):
+    pass
+
+
+class HostTimeout(HostError):
+    pass
+
+
+class EnumerationHost:
+    """A long-lived enumeration subprocess spoken to with JSON lines over stdin/stdout
+
+    Every request is a line like {"id": 1, "method": "enumerate", "params": {}},
+    the host answers with {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+    """
+
+    def __init__(
+        self,
+        command: Sequence[str],
+        timeout: float = HOST_TIMEOUT,
+        runner: Callable[..., subprocess.Popen] = subprocess.Popen,
+        **popen_kwargs,
+    ) -> None:
+        self.command = list(command)
+        self.timeout = timeout
+        self.runner = runner
+        self.popen_kwargs = popen_kwargs
+
+        self._process: Optional[subprocess.Popen] = None
+        self._responses: Optional[queue.Queue] = None
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _read_stdout(self, process: subprocess.Popen, responses: queue.Queue) -> None:
+        for line in process.stdout:
+            responses.put(line)
+        responses.put(None)  # EOF, the host has died
+
+    def _read_stderr(self, process: subprocess.Popen) -> None:
+        for line in process.stderr:
+            logger.warning(f"Enumeration host: {line.rstrip()}")
+
+    def start(self) -> None:
+        self.close()
+
+        logger.debug(f"Starting enumeration host {self.command[0]}")
+        self._process = self.runner(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            **self.popen_kwargs,
+        )
+        self._responses = queue.Queue()
+
+        for target, args in (
+            (self._read_stdout, (self._process, self._responses)),
+            (self._read_stderr, (self._process,)),
+        ):
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+    def close(self, kill: bool = False) -> None:
+        if self._process is None:
+            return
+
+        process, self._process = self._process, None
+        try:
+            if kill:
+                raise subprocess.TimeoutExpired(self.command, 0)
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+    def _send(self, method: str, params: dict) -> int:
+        request_id = next(self._request_ids)
+
+        try:
+            self._process.stdin.write(
+                json.dumps({"id": request_id, "method": method, "params": params})
+                + "\n"
+            )
+            self._process.stdin.flush()
+        except OSError as e:
+            raise HostDied("Enumeration host is not accepting requests") from e
+
+        return request_id
+
+    def _receive(self, request_id: int, method: str, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+
+        while True:
+            try:
+                with span("host.wait"):
+                    line = self._responses.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+            except queue.Empty:
+                # The host is stuck, the next request gets a fresh one
+                self.close(kill=True)
+                raise HostTimeout(f"'{method}' took longer than {timeout} s")
+
+            if line is None:
+                raise HostDied("Enumeration host exited")
+
+            try:
+                with span("host.json_decode"):
+                    response = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed host output: {line.rstrip()}")
+                continue
+
+            if response.get("id") != request_id:
+                continue  # Late answer to a request that has timed out or was abandoned
+
+            if "error" in response:
+                raise HostError(response["error"])
+
+            return response
+
+    def stream(
+        self, method: str, timeout: Optional[float] = None, **params
+    ) -> Iterator[Any]:
+        """Yield the records of a response as the host writes them
+
+        A streamed response is any number of {"id": 1, "record": ...} lines closed by
+        {"id": 1, "done": true}. A plain {"id": 1, "result": ...} is accepted too, its
+        result is yielded item by item if it is a list and as one record otherwise.
+        The timeout applies to the wait for every next line.
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            for attempt in range(2):
+                if not self.is_alive():
+                    self.start()
+
+                received_any = False
+                try:
+                    request_id = self._send(method, params)
+
+                    while True:
+                        response = self._receive(request_id, method, timeout)
+                        received_any = True
+
+                        if "record" in response:
+                            yield response["record"]
+                        else:
+                            yield from iter_json_records(response.get("result"))
+                            return
+                except HostDied:
+                    self.close()
+                    # Records already handed out cannot be taken back
+                    if attempt or received_any:
+                        raise
+                    logger.warning("Enumeration host has died, restarting it")
+
+    def request(self, method: str, timeout: Optional[float] = None, **params) -> Any:
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            for attempt in range(2):
+                if not self.is_alive():
+                    self.start()
+
+                try:
+                    request_id = self._send(method, params)
+                    return self._receive(request_id, method, timeout).get("result")
+                except HostDied:
+                    self.close()
+                    if attempt:
+                        raise
+                    logger.warning("Enumeration host has died, restarting it")
+
+
+def iter_json_records(value: Any) -> Iterator[Any]:
+    """ConvertTo-Json writes a single object instead of a one item array"""
+
+    if value is None:
+        return
+    elif isinstance(value, list):
+        yield from value
+    else:
+        yield value
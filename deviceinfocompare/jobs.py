@@ -0,0 +1,174 @@
+"""Background work of the GUI, run on a shared thread pool"""
+
+import contextlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Set
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+from deviceinfocompare import profiling
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(QObject):
+    """fn(job) runs on the pool with job.processor using a session of its own
+
+    fn reports progress and checks for cancellation through the job. The
+    signals are delivered in the thread the job was made in
+    """
+
+    PROGRESS_INTERVAL = 0.1  # Seconds between the progress signals of track()
+
+    progress = pyqtSignal(int, int)  # Done and total, a total of 0 is unknown
+    succeeded = pyqtSignal(object)  # What fn returned
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()  # After any of the three above
+
+    def __init__(
+        self, name: str, fn: Callable[["Job"], Any], read_only: bool = True
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.read_only = read_only
+        self.processor = None
+
+        self._cancel_event = threading.Event()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancel_event.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Call back on cancellation, for work that is not checking is_cancelled"""
+
+        with self._lock:
+            if not self._cancel_event.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+
+        callback()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"{self.name} was cancelled")
+
+    def track(self, iterable: Iterable, total: int = 0) -> Iterator:
+        """Pass the items through, checking for cancellation and reporting progress"""
+
+        done = 0
+        reported_at = time.monotonic()
+
+        for item in iterable:
+            self.check_cancelled()
+            yield item
+            done += 1
+
+            now = time.monotonic()
+            if now - reported_at >= self.PROGRESS_INTERVAL:
+                self.progress.emit(done, total)
+                reported_at = now
+
+        self.progress.emit(done, total)
+
+
+class _JobRunnable(QRunnable):
+    def __init__(self, scheduler: "JobScheduler", job: Job) -> None:
+        super().__init__()
+        self.scheduler = scheduler
+        self.job = job
+
+    def run(self) -> None:
+        self.scheduler._run(self.job)
+
+
+class JobScheduler(QObject):
+    """Runs jobs on a thread pool, read only jobs side by side and the others one
+    at a time, every job with a new session of session_factory"""
+
+    MIN_THREADS = 4  # A watch job holds a thread for as long as it watches
+
+    jobs_changed = pyqtSignal()
+
+    def __init__(self, processor, session_factory, parent=None) -> None:
+        super().__init__(parent)
+        self.processor = processor
+        self.session_factory = session_factory
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(
+            max(self.MIN_THREADS, QThreadPool.globalInstance().maxThreadCount())
+        )
+
+        self.jobs: Set[Job] = set()  # Referenced until they have finished
+        self._write_lock = threading.Lock()
+
+    def submit(self, job: Job) -> Job:
+        job.processor = self.processor
+        job.finished.connect(self._forget)
+
+        self.jobs.add(job)
+        self.jobs_changed.emit()
+
+        self.pool.start(_JobRunnable(self, job))
+        return job
+
+    @pyqtSlot()
+    def _forget(self) -> None:
+        self.jobs.discard(self.sender())
+        self.jobs_changed.emit()
+
+    def _run(self, job: Job) -> None:
+        # The breakdown logged at the end is of this job only
+        with profiling.collect():
+            session = None
+
+            try:
+                with contextlib.nullcontext() if job.read_only else self._write_lock:
+                    job.check_cancelled()
+
+                    session = self.session_factory()
+                    with self.processor.bind_session(session):
+                        result = job.fn(job)
+            except JobCancelled:
+                logger.info(f"{job.name} was cancelled")
+                job.cancelled.emit()
+            except Exception as e:
+                logger.exception(f"{job.name} has failed")
+                job.failed.emit(f"{type(e).__name__}: {e}")
+            else:
+                job.succeeded.emit(result)
+            finally:
+                if session is not None:
+                    session.close()
+
+                if profiling.is_enabled():
+                    logger.debug(
+                        f"Stage breakdown of {job.name}:\n{profiling.format_breakdown()}"
+                    )
+
+                job.finished.emit()
+
+    def cancel_all(self) -> None:
+        for job in list(self.jobs):
+            job.cancel()
+
+    def wait(self, msecs: int = -1) -> bool:
+        return self.pool.waitForDone(msecs)
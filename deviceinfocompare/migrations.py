@@ -0,0 +1,176 @@
+import datetime
+import logging
+import platform
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from deviceinfocompare.data import SchemaVersion
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    desc: str
+    apply: Callable[[Connection], None]
+    transactional: bool = True
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, desc: str, transactional: bool = True):
+    def register(fn: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, desc, fn, transactional))
+        return fn
+
+    return register
+
+
+@migration(1, "Index device rows by dump")
+def index_device_dump_id(conn: Connection) -> None:
+    # Covers the id and status columns compare needs without touching the table
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_device_dump_id "
+            "ON device (dump_id, device_id, device_status)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_delta_device_dump_id "
+            "ON delta_device (dump_id)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_dump_delta_base_dump_id "
+            "ON dump_delta (base_dump_id)"
+        )
+    )
+
+
+@migration(2, "Index device rows by device id")
+def index_device_device_id(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_device_device_id "
+            "ON device (device_id, dump_id, device_status)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_dump_membership_record_id "
+            "ON dump_membership (record_id)"
+        )
+    )
+
+
+@migration(3, "Switch to incremental auto vacuum", transactional=False)
+def enable_incremental_vacuum(conn: Connection) -> None:
+    # auto_vacuum can only be changed on an existing database by rebuilding it
+    if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+@migration(4, "Add views over the stored device rows of all dump storages")
+def create_dump_device_views(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE VIEW IF NOT EXISTS full_dump_device AS "
+            "SELECT dump_id, device_id, device_name, device_class, device_status "
+            "FROM device "
+            "UNION ALL "
+            "SELECT m.dump_id, r.device_id, r.device_name, r.device_class, r.device_status "
+            "FROM dump_membership m JOIN device_record r ON r.id = m.record_id"
+        )
+    )
+    # A delta dump is its checkpoint without the changed devices plus the changes
+    conn.execute(
+        text(
+            "CREATE VIEW IF NOT EXISTS dump_device AS "
+            "SELECT dump_id, device_id, device_name, device_class, device_status "
+            "FROM full_dump_device "
+            "UNION ALL "
+            "SELECT d.dump_id, f.device_id, f.device_name, f.device_class, f.device_status "
+            "FROM dump_delta d JOIN full_dump_device f ON f.dump_id = d.base_dump_id "
+            "WHERE NOT EXISTS (SELECT 1 FROM delta_device c "
+            "WHERE c.dump_id = d.dump_id AND c.device_id = f.device_id) "
+            "UNION ALL "
+            "SELECT dump_id, device_id, device_name, device_class, device_status "
+            "FROM delta_device WHERE change != 'removed'"
+        )
+    )
+
+
+@migration(5, "Add the host a dump was made on")
+def add_dump_host(conn: Connection) -> None:
+    # New databases get the column from the model already
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(dump)"))]
+    if "host" not in columns:
+        conn.execute(text("ALTER TABLE dump ADD COLUMN host VARCHAR"))
+
+    # Every dump so far was made on this machine
+    conn.execute(
+        text("UPDATE dump SET host = :host WHERE host IS NULL"),
+        {"host": platform.node()},
+    )
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_dump_host ON dump (host, id)"))
+
+
+@migration(6, "Index delta rows by device id")
+def index_delta_device_device_id(conn: Connection) -> None:
+    # The dump_device view looks up the changed devices of a delta dump by id
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_delta_device_device_id "
+            "ON delta_device (dump_id, device_id)"
+        )
+    )
+    conn.execute(text("DROP INDEX IF EXISTS ix_delta_device_dump_id"))
+
+
+@migration(7, "Drop the cached compares of devices with an unknown status")
+def clear_compare_cache(conn: Connection) -> None:
+    # Diffs of stored dumps skipped the devices whose status is NULL before
+    conn.execute(text("DELETE FROM compare_cache"))
+
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """Apply every pending migration in order, each one in its own transaction"""
+
+    with engine.connect() as conn:
+        current_version = get_schema_version(conn)
+
+    for pending in sorted(MIGRATIONS, key=lambda m: m.version):
+        if pending.version <= current_version:
+            continue
+
+        logger.info(f"Migrating the database to v{pending.version}: {pending.desc}")
+
+        if not pending.transactional:
+            with engine.connect() as conn:
+                with conn.execution_options(isolation_level="AUTOCOMMIT"):
+                    pending.apply(conn)
+
+        with engine.begin() as conn:
+            if pending.transactional:
+                pending.apply(conn)
+            conn.execute(
+                insert(SchemaVersion).values(
+                    version=pending.version,
+                    datetime=datetime.datetime.utcnow(),
+                    desc=pending.desc,
+                )
+            )
+
+        current_version = pending.version
+
+    return current_version
@@ -0,0 +1,102 @@
+import logging
+import select
+import socket
+from typing import Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# Multicast group the kernel sends its uevents to (udev uses group 2)
+KERNEL_UEVENT_GROUP = 1
+
+
+def parse_uevent(message: bytes) -> Optional[Dict[str, str]]:
+    """Parse "ACTION@DEVPATH\0KEY=VALUE\0..." into a dict"""
+
+    header, *fields = message.decode("utf8", errors="replace").split("\0")
+    if "@" not in header:
+        return None  # libudev messages and garbage
+
+    uevent = {}
+    for field in fields:
+        key, sep, value = field.partition("=")
+        if sep:
+            uevent[key] = value
+
+    uevent.setdefault("ACTION", header.partition("@")[0])
+    uevent.setdefault("DEVPATH", header.partition("@")[2])
+
+    return uevent
+
+
+class UeventMonitor:
+    """Kernel device events read from a netlink socket, Linux only"""
+
+    def __init__(self) -> None:
+        self.sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+        )
+        try:
+            self.sock.bind((0, KERNEL_UEVENT_GROUP))
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def read_events(self, timeout: float = 0) -> List[Dict[str, str]]:
+        """Wait up to timeout seconds for the first event, then return all pending"""
+
+        events = []
+
+        if timeout > 0:
+            select.select([self.sock], [], [], timeout)
+
+        while True:
+            try:
+                message = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                # ENOBUFS, the kernel dropped events, so something did happen
+                logger.warning("Uevent buffer overflowed, some events were lost")
+                events.append({"ACTION": "overflow", "DEVPATH": ""})
+                continue
+
+            uevent = parse_uevent(message)
+            if uevent is not None:
+                events.append(uevent)
+
+        return events
+
+    def has_changed(self) -> bool:
+        return bool(self.read_events())
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class PollingMonitor:
+    """Detects changes by comparing a cheap fingerprint with the one of the last call
+
+    The fingerprint is taken on every call, a snapshot only asks when it is about
+    to be reused
+    """
+
+    def __init__(self, fingerprint: Callable[[], Hashable]) -> None:
+        self.fingerprint = fingerprint
+
+        self._last_fingerprint = fingerprint()
+
+    def has_changed(self) -> bool:
+        fingerprint = self.fingerprint()
+        changed = fingerprint != self._last_fingerprint
+        self._last_fingerprint = fingerprint
+
+        return changed
+
+    def close(self) -> None:
+        pass
@@ -1,133 +1,1133 @@
+import base64
+import contextlib
 import datetime
-import json
+import hashlib
+import itertools
 import logging
+import os
+import platform
 import subprocess
-import sys
-from typing import Sequence
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import text
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.orm import Session
 
-from deviceinfocompare.data import Device, Dump
-from deviceinfocompare.settings import ENGINE, SESSION, closeDB
+from deviceinfocompare.cache import CompareCache, DeviceSnapshot, LRUCache
+from deviceinfocompare.compare import DeviceDiff, diff_stored_dumps
+from deviceinfocompare.data import (
+    DeltaDevice,
+    Device,
+    DeviceRecord,
+    Dump,
+    DumpDelta,
+    DumpMembership,
+    StoredDevice,
+    dump_device_view,
+)
+from deviceinfocompare.exchange import (
+    DumpInfo,
+    ExportReader,
+    is_export_file,
+    write_export,
+)
+from deviceinfocompare.fleet import (
+    HostInfo,
+    LostDevice,
+    find_lost_devices,
+    get_hosts,
+    get_last_dump_id,
+    read_database_file,
+)
+from deviceinfocompare.history import HistoryScan
+from deviceinfocompare.host import EnumerationHost
+from deviceinfocompare.migrations import get_schema_version
+from deviceinfocompare.monitor import PollingMonitor, UeventMonitor
+from deviceinfocompare.profiling import span, timed, timed_iter
+from deviceinfocompare.settings import (
+    CHECKPOINT_CACHE_SIZE,
+    COMPARE_CACHE_SIZE,
+    DELTA_CHECKPOINT_INTERVAL,
+    SNAPSHOT_TTL,
+    SNAPSHOT_UNMONITORED_TTL,
+    STORAGE_MODE,
+    SYSFS_ROOT,
+    VACUUM_STEP_PAGES,
+    get_engine,
+    get_session_factory,
+)
 
 logger = logging.getLogger(__name__)
 
 
+# SQLite versions before 3.32 allow at most 999 bound variables per statement
+SQL_VARIABLE_LIMIT = 999
+
+# Rows per executemany while a dump is written
+INSERT_BATCH_SIZE = 500
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def hash_device_record(record: DeviceRecord) -> str:
+    return hashlib.sha1(repr(tuple(record)).encode("utf8")).hexdigest()
+
+
+def to_device_record(device) -> DeviceRecord:
+    """The status is made a bool, so a 1 read from a raw query hashes like True"""
+
+    device_status = device.device_status
+    if device_status is not None and not isinstance(device_status, bool):
+        device_status = bool(device_status)
+    elif isinstance(device, DeviceRecord):
+        return device
+
+    return DeviceRecord(
+        device.device_id,
+        device.device_name,
+        device.device_class,
+        device_status,
+    )
+
+
+def _row_values(row: DeviceRecord) -> dict:
+    return {
+        "device_id": row[0],
+        "device_name": row[1],
+        "device_class": row[2],
+        "device_status": row[3],
+    }
+
+
 class BaseProcessor:
+    STORAGE_MODES = ("flat", "dedup", "delta")
+
     def __init__(self) -> None:
-        self.engine = ENGINE
-        self.session = SESSION
+        self.engine = get_engine()
+        self.sessions = get_session_factory()
+        self._local = threading.local()
 
-    def __del__(self) -> None:
-        closeDB()
+        if STORAGE_MODE not in self.STORAGE_MODES:
+            raise Exception(f"Unknown storage mode '{STORAGE_MODE}'")
+        self.storage_mode = STORAGE_MODE
+
+        self.checkpoint_cache = LRUCache(CHECKPOINT_CACHE_SIZE)
+        change_monitor = self.create_change_monitor()
+        snapshot_ttl = (
+            SNAPSHOT_TTL
+            if change_monitor is not None
+            else min(SNAPSHOT_TTL, SNAPSHOT_UNMONITORED_TTL)
+        )
+        self.snapshot = DeviceSnapshot(snapshot_ttl, change_monitor)
+
+    @property
+    def session(self) -> Session:
+        """The session bound to this thread by bind_session, the scoped session of
+        the thread otherwise"""
+
+        session = getattr(self._local, "session", None)
+        return self.sessions() if session is None else session
+
+    @contextlib.contextmanager
+    def bind_session(self, session: Session) -> Iterator["BaseProcessor"]:
+        """Make the processor use the session in this thread, a session must not be
+        shared between threads"""
+
+        previous = getattr(self._local, "session", None)
+        self._local.session = session
+        try:
+            yield self
+        finally:
+            self._local.session = previous
+
+    @property
+    def compare_cache(self) -> CompareCache:
+        return CompareCache(self.session, COMPARE_CACHE_SIZE)
+
+    def _delete_orphaned_records(self) -> None:
+        self.session.execute(
+            delete(StoredDevice).where(
+                StoredDevice.id.not_in(select(DumpMembership.record_id))
+            )
+        )
+
+    def _lock_for_writing(self) -> None:
+        """Take the write lock of the database now instead of on the first write
+
+        pysqlite only begins a transaction on the first INSERT, UPDATE or DELETE,
+        what is read before that may be outdated by the time it is written
+        """
+
+        if not self.session.connection().connection.driver_connection.in_transaction:
+            self.session.execute(text("BEGIN IMMEDIATE"))
+
+    def _materialize_deltas_of(self, base_dump_ids: Sequence[int]) -> None:
+        """Turn the deltas based on the dumps into full dumps before those go away"""
+
+        # Otherwise a delta could be saved against a base between the lookup
+        # below and the removal of the base
+        self._lock_for_writing()
+
+        dependent_ids = []
+        for chunk in _batched(base_dump_ids, SQL_VARIABLE_LIMIT):
+            dependent_ids.extend(
+                row[0]
+                for row in self.session.query(DumpDelta.dump_id).filter(
+                    DumpDelta.base_dump_id.in_(chunk)
+                )
+            )
+
+        removed_ids = set(base_dump_ids)
+        for dump_id in dependent_ids:
+            if dump_id in removed_ids:
+                continue
+
+            rows = self._get_delta_rows(dump_id)
+            self._delete_dumps_rows([dump_id], keep_dump=True)
+            self._insert_flat_rows(dump_id, rows)
+            logger.debug(f"Delta dump #{dump_id} was turned into a full dump")
+
+    def _delete_dumps_rows(self, dump_ids: Sequence[int], keep_dump=False) -> None:
+        for chunk in _batched(dump_ids, SQL_VARIABLE_LIMIT):
+            self.session.execute(
+                delete(DeltaDevice).where(DeltaDevice.dump_id.in_(chunk))
+            )
+            self.session.execute(delete(DumpDelta).where(DumpDelta.dump_id.in_(chunk)))
+            self.session.execute(delete(Device).where(Device.dump_id.in_(chunk)))
+            self.session.execute(
+                delete(DumpMembership).where(DumpMembership.dump_id.in_(chunk))
+            )
+            if not keep_dump:
+                self.session.execute(delete(Dump).where(Dump.id.in_(chunk)))
+
+    @timed("query.remove_dumps")
+    def remove_dumps(self, dump_ids: Iterable[int]) -> None:
+        dump_ids = list(dump_ids)
+
+        try:
+            self._materialize_deltas_of(dump_ids)
+            self._delete_dumps_rows(dump_ids)
+            # Both ids of an entry are matched, so each chunk binds two lists
+            for chunk in _batched(dump_ids, SQL_VARIABLE_LIMIT // 2):
+                self.compare_cache.invalidate(chunk)
+            self._delete_orphaned_records()
+            self.session.commit()
+        except:
+            self.session.rollback()
+            raise
+
+        for dump_id in dump_ids:
+            self.checkpoint_cache.discard(dump_id)
+
+        self.reclaim_space()
 
     def remove_dump(self, dump_id: int):
-        dumps = self.session.query(Dump).filter_by(id=dump_id)
-        for rev in dumps:
-            self.session.delete(rev)
+        self.remove_dumps([dump_id])
 
-        devices = self.session.query(Device).filter_by(dump_id=dump_id)
-        for dev in devices:
-            self.session.delete(dev)
+    @timed("query.clear_dumps")
+    def clear_dumps(self) -> None:
+        try:
+            for table in (DeltaDevice, DumpDelta, Device, DumpMembership, Dump):
+                self.session.execute(delete(table))
+            self.session.execute(delete(StoredDevice))
+            self.compare_cache.clear()
+            self.session.commit()
+        except:
+            self.session.rollback()
+            raise
 
-        self.session.commit()
+        self.checkpoint_cache.clear()
+        self.reclaim_space()
 
-        # region Reduce DB size after deletion
-        logger.debug("Performing vacuum on deletion")
+    def reclaim_space(self, max_pages: Optional[int] = None) -> int:
+        """Return free pages to the OS in short incremental_vacuum steps"""
+
+        freed_pages = 0
 
         with self.engine.connect() as conn:
             with conn.execution_options(isolation_level="AUTOCOMMIT"):
-                conn.execute(text("vacuum"))
-        # endregion
+                # incremental_vacuum does nothing unless auto_vacuum is INCREMENTAL
+                if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                    logger.debug("Auto vacuum is not incremental, nothing reclaimed")
+                    return 0
 
-    def clear_dumps(self) -> None:
-        dumps = self.session.query(Dump)
-        for rev in dumps:
-            self.session.delete(rev)
+                free_pages = conn.execute(text("PRAGMA freelist_count")).scalar()
+
+                while free_pages and (max_pages is None or freed_pages < max_pages):
+                    step = min(free_pages, VACUUM_STEP_PAGES)
+                    if max_pages is not None:
+                        step = min(step, max_pages - freed_pages)
+
+                    conn.execute(text(f"PRAGMA incremental_vacuum({step})"))
+
+                    # A step which freed nothing would repeat forever
+                    left_pages = conn.execute(text("PRAGMA freelist_count")).scalar()
+                    if left_pages >= free_pages:
+                        break
+                    freed_pages += free_pages - left_pages
+                    free_pages = left_pages
+
+        logger.debug(f"Reclaimed {freed_pages} free page(s)")
+        return freed_pages
+
+    def vacuum(self) -> None:
+        """Rebuild the whole database file, blocks it until finished"""
+
+        logger.info("Performing full vacuum")
 
-        devices = self.session.query(Device)
-        for dev in devices:
-            self.session.delete(dev)
-        self.session.commit()
+        with self.engine.connect() as conn:
+            with conn.execution_options(isolation_level="AUTOCOMMIT"):
+                conn.execute(text("vacuum"))
 
+    @timed("query.get_dump_list")
     def get_dump_list(self) -> Sequence[tuple]:
         dumps = self.session.query(Dump)
         rev_list = []
 
         for rev in dumps:
-            rev_list.append((rev.id, rev.datetime, rev.desc))
+            rev_list.append((rev.id, rev.datetime, rev.desc, rev.host))
 
         return rev_list
 
-    def get_devices_by_dump_id(self, dump_id: int) -> Sequence[Device]:
-        devices = self.session.query(Device).filter_by(dump_id=dump_id)
-        if not devices or not self.session.query(Dump).filter_by(id=dump_id).first():
+    @timed("query.get_dump_page")
+    def get_dump_page(
+        self,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = 100,
+        after_id: Optional[int] = None,
+    ) -> List[tuple]:
+        """Dumps newest first, older than before_id and newer than after_id, neither
+        of them included. No limit gives every such dump"""
+
+        query = self.session.query(Dump.id, Dump.datetime, Dump.desc, Dump.host)
+        if before_id is not None:
+            query = query.filter(Dump.id < before_id)
+        if after_id is not None:
+            query = query.filter(Dump.id > after_id)
+
+        query = query.order_by(Dump.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        return [tuple(row) for row in query]
+
+    # region Reading stored rows
+    def _get_delta_base_id(self, dump_id: int) -> Optional[int]:
+        return (
+            self.session.query(DumpDelta.base_dump_id)
+            .filter_by(dump_id=dump_id)
+            .scalar()
+        )
+
+    def _is_dedup_dump(self, dump_id: int) -> bool:
+        return (
+            self.session.query(DumpMembership.dump_id)
+            .filter_by(dump_id=dump_id)
+            .first()
+            is not None
+        )
+
+    def _get_flat_rows(self, dump_id: int) -> List[DeviceRecord]:
+        return [
+            DeviceRecord._make(row)
+            for row in self.session.execute(
+                select(
+                    Device.device_id,
+                    Device.device_name,
+                    Device.device_class,
+                    Device.device_status,
+                ).where(Device.dump_id == dump_id)
+            )
+        ]
+
+    def _get_dedup_rows(self, dump_id: int) -> List[DeviceRecord]:
+        return [
+            DeviceRecord._make(row)
+            for row in self.session.execute(
+                select(
+                    StoredDevice.device_id,
+                    StoredDevice.device_name,
+                    StoredDevice.device_class,
+                    StoredDevice.device_status,
+                )
+                .join(DumpMembership, DumpMembership.record_id == StoredDevice.id)
+                .where(DumpMembership.dump_id == dump_id)
+            )
+        ]
+
+    def _get_full_rows(self, dump_id: int) -> List[DeviceRecord]:
+        if self._is_dedup_dump(dump_id):
+            return self._get_dedup_rows(dump_id)
+        return self._get_flat_rows(dump_id)
+
+    def _get_checkpoint_rows(self, dump_id: int) -> Tuple[DeviceRecord, ...]:
+        # Ids of deleted dumps are reused, maybe by another process, so the rows
+        # are only taken from the cache for the very dump they were read from
+        dump_datetime = self.session.query(Dump.datetime).filter_by(id=dump_id).scalar()
+
+        cached = self.checkpoint_cache.get(dump_id)
+        if cached is not None and cached[0] == dump_datetime:
+            return cached[1]
+
+        rows = tuple(self._get_full_rows(dump_id))
+        self.checkpoint_cache.put(dump_id, (dump_datetime, rows))
+        return rows
+
+    def _get_delta_rows(self, dump_id: int) -> List[DeviceRecord]:
+        base_rows = self._get_checkpoint_rows(self._get_delta_base_id(dump_id))
+        rows = {row[0]: row for row in base_rows}
+
+        changes = self.session.execute(
+            select(
+                DeltaDevice.change,
+                DeltaDevice.device_id,
+                DeltaDevice.device_name,
+                DeltaDevice.device_class,
+                DeltaDevice.device_status,
+            )
+            .where(DeltaDevice.dump_id == dump_id)
+            .order_by(DeltaDevice.id)
+        )
+        for change, *row in changes:
+            if change == "removed":
+                rows.pop(row[0], None)
+            else:
+                rows[row[0]] = DeviceRecord._make(row)
+
+        return list(rows.values())
+
+    # endregion
+
+    @timed("query.get_devices_by_dump_id")
+    def get_devices_by_dump_id(self, dump_id: int) -> Sequence[DeviceRecord]:
+        if not self.session.query(Dump).filter_by(id=dump_id).first():
             raise Exception(f"No devices found by dump_id {dump_id}")
-        return devices
 
-    def get_devices_of_last_dump(self) -> Sequence[Device]:
-        dump = self.session.query(Dump).order_by(Dump.id.desc()).first()
-        if not dump:
-            raise Exception("No dumps found")
-        return self.session.query(Device).filter_by(dump_id=dump.id)
+        if self._get_delta_base_id(dump_id) is not None:
+            return self._get_delta_rows(dump_id)
+
+        return self._get_full_rows(dump_id)
+
+    @timed("query.get_devices_of_last_dump")
+    def get_devices_of_last_dump(self) -> Sequence[DeviceRecord]:
+        """The newest dump of this machine, imported dumps of others are skipped"""
+
+        host = platform.node()
+        dump_id = get_last_dump_id(self.session, host)
+        if dump_id is None:
+            raise Exception(f"No dumps found for host {host}")
+        return self.get_devices_by_dump_id(dump_id)
+
+    @timed("query.compare_dumps")
+    def compare_dumps(self, left_dump_id: int, right_dump_id: int) -> DeviceDiff:
+        """Diff an old (left) stored dump against a newer (right) one"""
+
+        diff = self.compare_cache.get(left_dump_id, right_dump_id)
+        if diff is not None:
+            logger.debug(f"Compare of #{left_dump_id} and #{right_dump_id} is cached")
+            return diff
+
+        for dump_id in (left_dump_id, right_dump_id):
+            if not self.session.query(Dump).filter_by(id=dump_id).first():
+                raise Exception(f"No devices found by dump_id {dump_id}")
+
+        diff = diff_stored_dumps(self.session, left_dump_id, right_dump_id)
+        self.compare_cache.put(left_dump_id, right_dump_id, diff)
+
+        return diff
+
+    def get_history(
+        self, device_id: Optional[str] = None, host: Optional[str] = None
+    ) -> HistoryScan:
+        """Iterate the result to scan, see HistoryScan. The host defaults to this
+        machine, dumps of other hosts are not part of its history"""
+
+        return HistoryScan(self.session, host or platform.node(), device_id)
+
+    def create_change_monitor(self):
+        """Something with has_changed() to invalidate the current device snapshot,
+        with None it is only kept for SNAPSHOT_UNMONITORED_TTL"""
+
+        return None
+
+    def enumerate_devices(self) -> Iterator[DeviceRecord]:
+        """Yield the present devices while they are being enumerated"""
+
+        raise NotImplementedError
+
+    def get_current_devices(self) -> Sequence[DeviceRecord]:
+        return list(self.iter_current_devices())
+
+    def iter_current_devices(self) -> Iterator[DeviceRecord]:
+        records = self.snapshot.get()
+        if records is not None:
+            logger.debug("Reusing the current device snapshot")
+            yield from records
+            return
+
+        records = []
+        for record in timed_iter("enumerate", self.enumerate_devices()):
+            records.append(record)
+            yield record
+
+        self.snapshot.put(records)
+
+    # region Writing stored rows
+    def _insert_flat_rows(self, dump_id: int, rows: Iterable[DeviceRecord]) -> None:
+        for batch in _batched(rows, INSERT_BATCH_SIZE):
+            self.session.execute(
+                insert(Device),
+                [dict(_row_values(row), dump_id=dump_id) for row in batch],
+            )
+
+    def _insert_dedup_rows(self, dump_id: int, rows: Iterable[DeviceRecord]) -> None:
+        def fetch_record_ids(hashes: Sequence[str]) -> Dict[str, int]:
+            record_ids = {}
+            for chunk in _batched(hashes, SQL_VARIABLE_LIMIT):
+                record_ids.update(
+                    self.session.execute(
+                        select(StoredDevice.hash, StoredDevice.id).where(
+                            StoredDevice.hash.in_(chunk)
+                        )
+                    ).all()
+                )
+            return record_ids
+
+        seen_hashes = set()
+
+        for batch in _batched(rows, INSERT_BATCH_SIZE):
+            rows_by_hash = {}
+            for row in batch:
+                row_hash = hash_device_record(row)
+                if row_hash not in seen_hashes:
+                    rows_by_hash.setdefault(row_hash, row)
+            seen_hashes.update(rows_by_hash)
+
+            hashes = list(rows_by_hash)
+            record_ids = fetch_record_ids(hashes)
+
+            unknown_hashes = [h for h in hashes if h not in record_ids]
+            if unknown_hashes:
+                self.session.execute(
+                    insert(StoredDevice),
+                    [
+                        dict(_row_values(rows_by_hash[h]), hash=h)
+                        for h in unknown_hashes
+                    ],
+                )
+                record_ids.update(fetch_record_ids(unknown_hashes))
+
+            if hashes:
+                self.session.execute(
+                    insert(DumpMembership),
+                    [{"dump_id": dump_id, "record_id": record_ids[h]} for h in hashes],
+                )
+
+    def _get_checkpoint_for_delta(self, dump_id: int) -> Optional[int]:
+        """The latest full dump if it has room for one more delta"""
+
+        # Deltas are only taken against dumps of the same machine
+        host = select(Dump.host).where(Dump.id == dump_id).scalar_subquery()
+        base_dump_id = (
+            self.session.query(Dump.id)
+            .filter(Dump.id != dump_id)
+            .filter(Dump.host == host)
+            .filter(Dump.id.not_in(select(DumpDelta.dump_id)))
+            .order_by(Dump.id.desc())
+            .limit(1)
+            .scalar()
+        )
+        if base_dump_id is None:
+            return None
+
+        delta_count = (
+            self.session.query(func.count(DumpDelta.dump_id))
+            .filter_by(base_dump_id=base_dump_id)
+            .scalar()
+        )
+        if delta_count >= DELTA_CHECKPOINT_INTERVAL:
+            return None
+
+        return base_dump_id
+
+    def _insert_delta_rows(self, dump_id: int, rows: Iterable[DeviceRecord]) -> None:
+        base_dump_id = self._get_checkpoint_for_delta(dump_id)
+        if base_dump_id is None:
+            logger.debug(f"Writing dump #{dump_id} as a full checkpoint")
+            self._insert_flat_rows(dump_id, rows)
+            return
+
+        self.session.add(DumpDelta(dump_id=dump_id, base_dump_id=base_dump_id))
+        self.session.flush()
+
+        base_rows = {row[0]: row for row in self._get_checkpoint_rows(base_dump_id)}
+
+        def iter_changes() -> Iterator[dict]:
+            for row in rows:
+                base_row = base_rows.pop(row[0], None)
+                if base_row is None:
+                    yield dict(_row_values(row), change="added")
+                elif base_row != row:
+                    yield dict(_row_values(row), change="changed")
 
-    def get_current_devices(self) -> Sequence[Device]:
-        pass
+            # Only known once every current row has been seen
+            for row in base_rows.values():
+                yield dict(_row_values(row), change="removed")
 
-    def dump_devices(self, dump_desc: str) -> Dump:
-        pass
+        change_count = 0
+        for batch in _batched(iter_changes(), INSERT_BATCH_SIZE):
+            self.session.execute(
+                insert(DeltaDevice), [dict(c, dump_id=dump_id) for c in batch]
+            )
+            change_count += len(batch)
+
+        logger.debug(
+            f"Dump #{dump_id} was stored as {change_count} change(s) against dump #{base_dump_id}"
+        )
+
+    # endregion
+
+    @timed("save_dump")
+    def save_dump(
+        self,
+        dump_desc: str,
+        devices: Iterable,
+        host: Optional[str] = None,
+        dump_datetime: Optional[datetime.datetime] = None,
+    ) -> Dump:
+        """Store a dump and all of its devices in a single transaction
+
+        The devices may be a generator, they are written in batches as they come
+        and nothing is kept if it raises halfway. The host and datetime default to
+        this machine and now
+        """
+
+        dump = Dump(
+            datetime=dump_datetime or datetime.datetime.utcnow(),
+            desc=dump_desc,
+            host=host or platform.node(),
+        )
+        rows = (to_device_record(device) for device in devices)
+
+        try:
+            with span("save_dump.orm"):
+                self.session.add(dump)
+                self.session.flush()  # Assigns dump.id without committing
+
+            with span(f"save_dump.insert_{self.storage_mode}_rows"):
+                if self.storage_mode == "dedup":
+                    self._insert_dedup_rows(dump.id, rows)
+                elif self.storage_mode == "delta":
+                    self._insert_delta_rows(dump.id, rows)
+                else:
+                    self._insert_flat_rows(dump.id, rows)
+
+            with span("save_dump.commit"):
+                self.session.commit()
+        except:
+            self.session.rollback()
+            raise
+
+        with span("save_dump.orm"):
+            self.session.refresh(dump)
+        return dump
+
+    def dump_devices(self, dump_desc: str = "No description") -> Dump:
+        return self.save_dump(dump_desc, self.iter_current_devices())
+
+    def import_database_files(
+        self, paths: Iterable[Union[str, Path]], jobs: Optional[int] = None
+    ) -> int:
+        """Import the dumps of other machines' databases, return how many were new
+
+        The files are read in parallel worker processes while this process stays
+        the only writer. Dumps already imported (same host and datetime) are skipped
+        """
+
+        paths = list(paths)
+        jobs = jobs or min(len(paths), os.cpu_count() or 1)
+        known_dumps = set(self.session.query(Dump.host, Dump.datetime))
+        imported_count = 0
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(read_database_file, path): path for path in paths
+            }
+
+            for future in as_completed(futures):
+                for dump in future.result():
+                    if (dump.host, dump.datetime) in known_dumps:
+                        continue
+
+                    self.save_dump(
+                        dump.desc,
+                        dump.devices,
+                        host=dump.host,
+                        dump_datetime=dump.datetime,
+                    )
+                    known_dumps.add((dump.host, dump.datetime))
+                    imported_count += 1
+
+                logger.info(f"{futures[future]} was imported")
+
+        return imported_count
+
+    def import_export_file(self, path: Union[str, Path]) -> int:
+        """Import a .dicx file dump by dump without loading it whole"""
+
+        known_dumps = set(self.session.query(Dump.host, Dump.datetime))
+        imported_count = 0
+
+        with open(path, "rb") as export_file:
+            for dump_info, devices in ExportReader(export_file):
+                if (dump_info.host, dump_info.datetime) in known_dumps:
+                    continue
+
+                self.save_dump(
+                    dump_info.desc,
+                    devices,
+                    host=dump_info.host,
+                    dump_datetime=dump_info.datetime,
+                )
+                known_dumps.add((dump_info.host, dump_info.datetime))
+                imported_count += 1
+
+        logger.info(f"{path} was imported")
+        return imported_count
+
+    def import_files(
+        self, paths: Iterable[Union[str, Path]], jobs: Optional[int] = None
+    ) -> int:
+        """Import export files and other machines' databases, whichever they are"""
+
+        export_paths, database_paths = [], []
+        for path in paths:
+            with open(path, "rb") as import_file:
+                if is_export_file(import_file):
+                    export_paths.append(path)
+                else:
+                    database_paths.append(path)
+
+        imported_count = sum(self.import_export_file(path) for path in export_paths)
+        if database_paths:
+            imported_count += self.import_database_files(database_paths, jobs)
+
+        return imported_count
+
+    def _iter_dump_info(
+        self, dump_ids: Optional[Sequence[int]]
+    ) -> Iterator[Tuple[DumpInfo, Iterator[DeviceRecord]]]:
+        if dump_ids is None:
+            dump_ids = [row[0] for row in self.session.query(Dump.id).order_by(Dump.id)]
+
+        for dump_id in dump_ids:
+            dump = self.session.query(Dump).filter_by(id=dump_id).first()
+            if not dump:
+                raise Exception(f"No devices found by dump_id {dump_id}")
+
+            devices = (
+                DeviceRecord._make(row)
+                for row in self.session.execute(
+                    select(
+                        dump_device_view.c.device_id,
+                        dump_device_view.c.device_name,
+                        dump_device_view.c.device_class,
+                        dump_device_view.c.device_status,
+                    ).where(dump_device_view.c.dump_id == dump_id)
+                )
+            )
+            yield DumpInfo(dump.host, dump.datetime, dump.desc), devices
+
+    def export_dumps(
+        self, dump_ids: Optional[Sequence[int]], path: Union[str, Path]
+    ) -> None:
+        """Write the dumps (all of them if None) to a .dicx file"""
+
+        with self.engine.connect() as conn:
+            schema_version = get_schema_version(conn)
+
+        with open(path, "wb") as export_file:
+            write_export(export_file, self._iter_dump_info(dump_ids), schema_version)
+
+    @timed("query.get_hosts")
+    def get_hosts(self) -> List[HostInfo]:
+        return get_hosts(self.session)
+
+    @timed("query.find_lost_devices")
+    def find_lost_devices(self, device_class: str) -> List[LostDevice]:
+        return find_lost_devices(self.session, device_class)
+
+    @timed("query.compare_hosts")
+    def compare_hosts(self, left_host: str, right_host: str) -> DeviceDiff:
+        """Diff the last dumps of two machines"""
+
+        dump_ids = []
+        for host in (left_host, right_host):
+            dump_id = get_last_dump_id(self.session, host)
+            if dump_id is None:
+                raise Exception(f"No dumps found for host {host}")
+            dump_ids.append(dump_id)
+
+        return self.compare_dumps(*dump_ids)
+
+    def _get_used_db_bytes(self) -> int:
+        page_size = self.session.execute(text("PRAGMA page_size")).scalar()
+        page_count = self.session.execute(text("PRAGMA page_count")).scalar()
+        free_pages = self.session.execute(text("PRAGMA freelist_count")).scalar()
+        return (page_count - free_pages) * page_size
+
+    def get_storage_report(self) -> Dict[str, int]:
+        flat_rows = self.session.query(func.count(Device.id)).scalar()
+        memberships = self.session.query(func.count(DumpMembership.dump_id)).scalar()
+        records = self.session.query(func.count(StoredDevice.id)).scalar()
+
+        return {
+            "device_rows": flat_rows + memberships,
+            "stored_rows": flat_rows + records,
+            "saved_rows": memberships - records,
+            "used_bytes": self._get_used_db_bytes(),
+        }
+
+    def migrate_to_dedup(self) -> Dict[str, int]:
+        """Move every flat dump into the deduplicated storage, one dump per transaction"""
+
+        bytes_before = self._get_used_db_bytes()
+        flat_dump_ids = [
+            row[0] for row in self.session.query(Device.dump_id).distinct().all()
+        ]
+
+        for dump_id in flat_dump_ids:
+            try:
+                self._insert_dedup_rows(dump_id, self._get_flat_rows(dump_id))
+                self.session.execute(delete(Device).where(Device.dump_id == dump_id))
+                self.session.commit()
+            except:
+                self.session.rollback()
+                raise
+
+            self.checkpoint_cache.discard(dump_id)
+            logger.debug(f"Dump #{dump_id} was moved to the deduplicated storage")
+
+        report = self.get_storage_report()
+        report["migrated_dumps"] = len(flat_dump_ids)
+        report["bytes_before"] = bytes_before
+        report["saved_bytes"] = bytes_before - report["used_bytes"]
+
+        return report
 
 
 class WindowsProcessor(BaseProcessor):
-    def get_current_devices(self) -> Sequence[Device]:
-        subprocess.run(
+    HOST_SCRIPT = r"""
+[Console]::InputEncoding = [System.Text.Encoding]::UTF8
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+
+function Write-Response($response) {
+    [Console]::Out.WriteLine(($response | ConvertTo-Json -Compress -Depth 4))
+    [Console]::Out.Flush()
+}
+
+while (($line = [Console]::In.ReadLine()) -ne $null) {
+    $request = $line | ConvertFrom-Json
+    try {
+        switch ($request.method) {
+            "enumerate" {
+                Get-PnpDevice -PresentOnly |
+                    Select-Object Status,Class,FriendlyName,InstanceId |
+                    ForEach-Object { Write-Response @{ id = $request.id; record = $_ } }
+                $response = @{ id = $request.id; done = $true }
+            }
+            "ping" { $response = @{ id = $request.id; result = "pong" } }
+            default { throw "Unknown method $($request.method)" }
+        }
+    } catch {
+        $response = @{ id = $request.id; error = "$_" }
+    }
+    Write-Response $response
+}
+"""
+
+    def __init__(self, host: Optional[EnumerationHost] = None) -> None:
+        super().__init__()
+        self.host = host or EnumerationHost(
             [
                 "PowerShell",
-                "-Command",
-                '[Console]::OutputEncoding = [System.Text.Encoding]::GetEncoding("utf-8")',
+                "-NoLogo",
+                "-NoProfile",
+                "-NonInteractive",
+                "-EncodedCommand",
+                base64.b64encode(self.HOST_SCRIPT.encode("utf-16-le")).decode(),
             ],
             creationflags=subprocess.CREATE_NO_WINDOW,
         )
 
-        process_out = subprocess.check_output(
-            'PowerShell -Command "& {Get-PnpDevice -PresentOnly | Select-Object Status,Class,FriendlyName,InstanceId | ConvertTo-Json}"',
-            shell=False,
-            stdin=subprocess.DEVNULL,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-        ).decode("utf-8", errors="ignore")
-
-        # logger.debug(f"Process output was {process_out}")
-
-        try:
-            json_out = json.loads(process_out)
-        except:
-            logger.exception("")
-            sys.exit(1)
+    def __del__(self) -> None:
+        # __init__ may have failed before the host was set
+        host = getattr(self, "host", None)
+        if host is not None:
+            host.close()
 
-        device_list = []
-        for json_device in json_out:
+    def enumerate_devices(self) -> Iterator[DeviceRecord]:
+        for json_device in self.host.stream("enumerate"):
             status = True if json_device["Status"] == "OK" else False
-            device = Device(
+            yield DeviceRecord(
                 device_id=json_device["InstanceId"],
                 device_name=json_device["FriendlyName"],
                 device_class=json_device["Class"],
                 device_status=status,
-                dump_id=None,
             )
-            device_list.append(device)
 
-        return device_list
 
-    def dump_devices(self, dump_desc: str = "No description") -> Dump:
-        dump = Dump(datetime=datetime.datetime.utcnow(), desc=dump_desc)
-        self.session.add(dump)
-        self.session.commit()
-        self.session.refresh(dump)
-
-        device_list = self.get_current_devices()
-        for device in device_list:
-            device.dump_id = dump.id
-            self.session.add(device)
-            self.session.commit()
+class LinuxProcessor(BaseProcessor):
+    # Firmware descriptions and kernel bookkeeping buses, not separate hardware
+    SKIPPED_BUSES = (
+        "acpi",
+        "clockevents",
+        "clocksource",
+        "container",
+        "event_source",
+        "memory",
+        "memory_tiering",
+        "node",
+        "workqueue",
+    )
 
-        return dump
+    # Buses whose devices work without a bound driver
+    DRIVERLESS_BUSES = ("cpu",)
+
+    NAME_ATTRS = ("product", "name", "model", "label", "interface")
+    NAME_UEVENT_KEYS = ("HID_NAME", "NAME", "OF_NAME")
+
+    PCI_CLASSES = {
+        0x00: "Unclassified",
+        0x01: "Storage",
+        0x02: "Network",
+        0x03: "Display",
+        0x04: "Multimedia",
+        0x05: "Memory",
+        0x06: "Bridge",
+        0x07: "Communication",
+        0x08: "System",
+        0x09: "Input",
+        0x0A: "Docking",
+        0x0B: "Processor",
+        0x0C: "Serial bus",
+        0x0D: "Wireless",
+        0x0E: "Intelligent I/O",
+        0x0F: "Satellite",
+        0x10: "Encryption",
+        0x11: "Signal processing",
+        0x12: "Processing accelerator",
+        0x13: "Instrumentation",
+    }
+
+    def __init__(self, sysfs_root: Union[str, Path] = SYSFS_ROOT) -> None:
+        self.sysfs_root = Path(sysfs_root)
+        super().__init__()
+
+    @staticmethod
+    def _read_attr(path: str) -> Optional[str]:
+        try:
+            with open(path, "r", encoding="utf8", errors="replace") as attr_file:
+                return attr_file.read().strip() or None
+        except OSError:
+            return None
+
+    def _read_uevent(self, device_path: str) -> Dict[str, str]:
+        uevent = {}
+        content = self._read_attr(os.path.join(device_path, "uevent")) or ""
+        for line in content.splitlines():
+            key, _, value = line.partition("=")
+            uevent[key] = value
+        return uevent
+
+    def _get_device_classes(self) -> Dict[str, str]:
+        """Map real device paths to the first /sys/class they are exposed in"""
+
+        device_classes = {}
+
+        try:
+            class_dirs = sorted(
+                os.scandir(self.sysfs_root / "class"), key=lambda e: e.name
+            )
+        except OSError:
+            return device_classes
+
+        for class_dir in class_dirs:
+            try:
+                entries = list(os.scandir(class_dir.path))
+            except OSError:
+                continue
+
+            for entry in entries:
+                parent_link = os.path.join(entry.path, "device")
+                if not os.path.islink(parent_link):
+                    continue
+                device_classes.setdefault(os.path.realpath(parent_link), class_dir.name)
+
+        return device_classes
+
+    def _get_device_name(self, device_path: str, uevent: Dict[str, str]) -> str:
+        for attr in self.NAME_ATTRS:
+            name = self._read_attr(os.path.join(device_path, attr))
+            if name:
+                return name
+
+        for key in self.NAME_UEVENT_KEYS:
+            if uevent.get(key):
+                return uevent[key].strip('"')
+
+        if "PCI_ID" in uevent:
+            return f"PCI device {uevent['PCI_ID']}"
+
+        return os.path.basename(device_path)
+
+    def _get_pci_class(self, uevent: Dict[str, str]) -> Optional[str]:
+        try:
+            base_class = int(uevent["PCI_CLASS"], 16) >> 16
+        except (KeyError, ValueError):
+            return None
+        return self.PCI_CLASSES.get(base_class)
+
+    def read_device(
+        self, device_path: str, bus: str, device_classes: Dict[str, str]
+    ) -> DeviceRecord:
+        uevent = self._read_uevent(device_path)
+        modalias = uevent.get("MODALIAS") or self._read_attr(
+            os.path.join(device_path, "modalias")
+        )
+
+        device_class = (
+            device_classes.get(os.path.realpath(device_path))
+            or self._get_pci_class(uevent)
+            or bus
+        )
+
+        # A device is fine when a driver is bound to it or there is nothing to bind
+        has_driver = os.path.islink(os.path.join(device_path, "driver"))
+        status = has_driver or not modalias or bus in self.DRIVERLESS_BUSES
+
+        return DeviceRecord(
+            device_id=f"{bus.upper()}\\{os.path.basename(device_path)}",
+            device_name=self._get_device_name(device_path, uevent),
+            device_class=device_class,
+            device_status=status,
+        )
+
+    def create_change_monitor(self):
+        # Kernel uevents say nothing about a fixture tree
+        if self.sysfs_root == Path("/sys"):
+            try:
+                return UeventMonitor()
+            except OSError:
+                logger.debug("Kernel uevents are not available, polling sysfs instead")
+
+        return PollingMonitor(self._get_fingerprint)
+
+    def _iter_bus_entries(self) -> Iterator[Tuple[str, os.DirEntry]]:
+        try:
+            buses = sorted(os.scandir(self.sysfs_root / "bus"), key=lambda e: e.name)
+        except OSError:
+            logger.exception(f"Cannot read buses from {self.sysfs_root}")
+            return
+
+        for bus in buses:
+            if bus.name in self.SKIPPED_BUSES:
+                continue
+
+            try:
+                entries = sorted(
+                    os.scandir(os.path.join(bus.path, "devices")), key=lambda e: e.name
+                )
+            except OSError:
+                continue
+
+            for entry in entries:
+                yield bus.name, entry
+
+    def _get_fingerprint(self) -> Tuple:
+        """Which devices exist and have a driver, without reading any attributes"""
+
+        return tuple(
+            (bus_name, entry.name, os.path.islink(os.path.join(entry.path, "driver")))
+            for bus_name, entry in self._iter_bus_entries()
+        )
+
+    def enumerate_devices(self) -> Iterator[DeviceRecord]:
+        device_classes = self._get_device_classes()
+
+        for bus_name, entry in self._iter_bus_entries():
+            yield self.read_device(entry.path, bus_name, device_classes)
+
+    def _get_bus_of(self, device_path: str) -> Optional[str]:
+        subsystem_link = os.path.join(device_path, "subsystem")
+        if not os.path.islink(subsystem_link):
+            return None
+
+        subsystem = os.path.realpath(subsystem_link)
+        if os.path.basename(os.path.dirname(subsystem)) != "bus":
+            return None  # A /sys/class device
+        return os.path.basename(subsystem)
+
+    def read_event_devices(
+        self, uevent: Dict[str, str]
+    ) -> List[Tuple[str, Optional[DeviceRecord]]]:
+        """Re-read only the devices a uevent is about, None for removed ones
+
+        Events of class devices (a network interface, a block device...) change
+        the class of the bus device they belong to, so it is re-read instead
+        """
+
+        subsystem = uevent.get("SUBSYSTEM", "")
+        devpath = uevent.get("DEVPATH", "").strip("/")
+        if not devpath:
+            return []
+
+        if (self.sysfs_root / "bus" / subsystem).is_dir():
+            if subsystem in self.SKIPPED_BUSES:
+                return []
+
+            name = os.path.basename(devpath)
+            device_path = os.path.join(
+                self.sysfs_root, "bus", subsystem, "devices", name
+            )
+            if uevent.get("ACTION") == "remove" or not os.path.exists(device_path):
+                return [(f"{subsystem.upper()}\\{name}", None)]
+
+            record = self.read_device(
+                device_path, subsystem, self._get_device_classes()
+            )
+            return [(record.device_id, record)]
+
+        # Find the nearest bus device above the class device
+        parent = os.path.dirname(devpath)
+        while parent:
+            device_path = os.path.join(self.sysfs_root, parent)
+            bus = self._get_bus_of(device_path)
+            if bus is not None:
+                if bus in self.SKIPPED_BUSES:
+                    return []
+                record = self.read_device(device_path, bus, self._get_device_classes())
+                return [(record.device_id, record)]
+            parent = os.path.dirname(parent)
+
+        return []
+
+
+def get_processor() -> BaseProcessor:
+    system_name = platform.system()
+
+    if system_name == "Windows":
+        return WindowsProcessor()
+    elif system_name == "Linux":
+        return LinuxProcessor()
+    else:
+        raise Exception(f"DIC can't work on {system_name} yet")
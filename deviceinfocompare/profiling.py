@@ -0,0 +1,225 @@
+"""Per-stage timing of dumps, compares and queries
+
+Nothing is measured until enable() is called, span() then hands out a shared
+do-nothing context manager and timed() functions run as they are. Spans nest
+per thread: the self time of a span is its time minus the time of the spans
+opened inside it, so the self times of a breakdown add up to the time measured.
+
+The stats of all threads go together, except inside collect(): there the spans
+of the thread are kept apart, for a breakdown of one job among others.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+
+# Span name -> [calls, total seconds, self seconds]
+_stats: Dict[str, List] = {}
+
+
+class SpanStats(NamedTuple):
+    name: str
+    calls: int
+    total: float
+    self_time: float
+
+
+def _add_stats(stats: Dict[str, List], name: str, total: float, self_time: float):
+    values = stats.get(name)
+    if values is None:
+        values = stats[name] = [0, 0.0, 0.0]
+    values[0] += 1
+    values[1] += total
+    values[2] += self_time
+
+
+def _record(name: str, total: float, self_time: float) -> None:
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        _add_stats(stats, name, total, self_time)
+        return
+
+    with _lock:
+        _add_stats(_stats, name, total, self_time)
+
+
+class _Span:
+    """Measures every time it is entered, each exit counts as a call"""
+
+    __slots__ = ("name", "start", "child_time", "total", "self_time")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.total = 0.0
+        self.self_time = 0.0
+
+    def __enter__(self) -> "_Span":
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+
+        self.child_time = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        elapsed = time.perf_counter() - self.start
+
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_time += elapsed
+
+        self.total += elapsed
+        self.self_time += elapsed - self.child_time
+        self._exited()
+
+        return False
+
+    def _exited(self) -> None:
+        self.record()
+
+    def record(self) -> None:
+        _record(self.name, self.total, self.self_time)
+
+
+class _StageSpan(_Span):
+    """Adds up all the times it is entered, record() counts them as one call"""
+
+    __slots__ = ()
+
+    def _exited(self) -> None:
+        pass
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def span(name: str):
+    """with span("stage"): ... measures the block if profiling is enabled"""
+
+    return _Span(name) if _enabled else _NO_SPAN
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to measure every call of it as a span"""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """Measure the time spent making the items only, not the time of the
+    consumer in between, so streaming stages get their own share. The whole
+    iteration counts as one call"""
+
+    if not _enabled:
+        return iter(iterable)
+
+    def generator():
+        iterator = iter(iterable)
+        stage = _StageSpan(name)
+        try:
+            while True:
+                with stage:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            stage.record()
+
+    return generator()
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[None]:
+    """Keep the stats of the spans of this thread apart until the block ends,
+    take_stats() inside the block takes just those"""
+
+    previous = getattr(_local, "stats", None)
+    _local.stats = {}
+    try:
+        yield
+    finally:
+        _local.stats = previous
+
+
+def take_stats() -> List[SpanStats]:
+    """Return the stats gathered so far, most self time first, and start over"""
+
+    global _stats
+
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        _local.stats = {}
+    else:
+        with _lock:
+            stats, _stats = _stats, {}
+
+    return sorted(
+        (SpanStats(name, *values) for name, values in stats.items()),
+        key=lambda stats: stats.self_time,
+        reverse=True,
+    )
+
+
+def format_breakdown(stats: Optional[List[SpanStats]] = None) -> str:
+    stats = take_stats() if stats is None else stats
+    if not stats:
+        return "No stages were measured"
+
+    name_width = max(len("Stage"), *(len(stage.name) for stage in stats))
+    lines = [f"{'Stage':<{name_width}} {'Calls':>8} {'Total ms':>11} {'Self ms':>11}"]
+    for stage in stats:
+        lines.append(
+            f"{stage.name:<{name_width}} {stage.calls:>8}"
+            f" {stage.total * 1000:>11.2f} {stage.self_time * 1000:>11.2f}"
+        )
+    lines.append(
+        f"{'Self time in total':<{name_width}} {'':>8} {'':>11}"
+        f" {sum(stage.self_time for stage in stats) * 1000:>11.2f}"
+    )
+
+    return "\n".join(lines)
@@ -1,16 +1,16 @@
-import logging
-import logging.config
 import os
 import sys
 from pathlib import Path
 
-import sqlalchemy
-from dotenv import load_dotenv
-from sqlalchemy.orm import sessionmaker
+# Importing settings has to stay cheap: SQLAlchemy, the database and logging
+# are set up on first use, see get_engine, get_session and setup_logging. A .env
+# is read right away since the settings below come from the environment, it is
+# meant for development
 
-from deviceinfocompare.data import DeclarativeBase
+if os.path.isfile("./.env"):
+    from dotenv import load_dotenv
 
-load_dotenv("./.env", verbose=True)
+    load_dotenv("./.env", verbose=True)
 
 
 BASE_DIR: Path = Path(
@@ -27,6 +27,49 @@ LOG_DIR: Path = Path(os.path.join(BASE_DIR, "logs"))
 
 RESOURCE_PATH = Path(getattr(sys, "_MEIPASS", os.path.abspath(".")))
 
+# "flat" stores every device row per dump, "dedup" stores unique device states once,
+# "delta" stores only the changes against the latest full dump
+STORAGE_MODE: str = os.environ.get("DIC_STORAGE_MODE", "flat")
+
+# A full dump is written after this many delta dumps
+DELTA_CHECKPOINT_INTERVAL: int = int(
+    os.environ.get("DIC_DELTA_CHECKPOINT_INTERVAL", 10)
+)
+
+# Pages returned to the OS per incremental vacuum step after deletions
+VACUUM_STEP_PAGES: int = int(os.environ.get("DIC_VACUUM_STEP_PAGES", 256))
+
+CHECKPOINT_CACHE_SIZE: int = int(os.environ.get("DIC_CHECKPOINT_CACHE_SIZE", 4))
+
+# Diffs of stored dump pairs kept in the database, 0 disables the cache
+COMPARE_CACHE_SIZE: int = int(os.environ.get("DIC_COMPARE_CACHE_SIZE", 64))
+
+# Seconds an enumeration host request may take before the host is restarted
+HOST_TIMEOUT: float = float(os.environ.get("DIC_HOST_TIMEOUT", 120))
+
+# Seconds the current device list is reused for, 0 always enumerates
+SNAPSHOT_TTL: float = float(os.environ.get("DIC_SNAPSHOT_TTL", 30))
+
+# The same where hardware changes are not reported (Windows), a device swapped
+# in the meantime goes unnoticed, so it is kept short. SNAPSHOT_TTL caps it
+SNAPSHOT_UNMONITORED_TTL: float = float(
+    os.environ.get("DIC_SNAPSHOT_UNMONITORED_TTL", 5)
+)
+
+SYSFS_ROOT: Path = Path(os.environ.get("DIC_SYSFS_ROOT", "/sys"))
+
+# Milliseconds a connection waits for another one (the GUI, cdic) to finish writing
+SQLITE_BUSY_TIMEOUT: int = int(os.environ.get("DIC_SQLITE_BUSY_TIMEOUT", 30000))
+
+# Bytes of the database file read through memory mapping
+SQLITE_MMAP_SIZE: int = int(os.environ.get("DIC_SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+# KiB of page cache per connection
+SQLITE_CACHE_SIZE: int = int(os.environ.get("DIC_SQLITE_CACHE_SIZE", 32 * 1024))
+
+# Lines the GUI log keeps, older ones are dropped
+LOG_VIEW_MAX_LINES: int = int(os.environ.get("DIC_LOG_VIEW_MAX_LINES", 5000))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -55,22 +98,98 @@ LOGGING = {
     },
 }
 
-BASE_DIR.mkdir(parents=True, exist_ok=True)
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-logging.config.dictConfig(LOGGING)
+_logging_configured = False
+_engine = None
+_session_factory = None
 
-logger = logging.getLogger(__name__)
 
-logger.info(f"Base dir is {BASE_DIR}")
+def setup_logging() -> None:
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
 
-ENGINE = sqlalchemy.create_engine(
-    "sqlite:///" + os.path.join(BASE_DIR, "deviceinfo.db")
-)
-DeclarativeBase.metadata.create_all(ENGINE)
-SESSION = sessionmaker(bind=ENGINE)()
+    import logging
+    import logging.config
+
+    BASE_DIR.mkdir(parents=True, exist_ok=True)
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    logging.config.dictConfig(LOGGING)
+
+    logging.getLogger(__name__).info(f"Base dir is {BASE_DIR}")
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new database, migrations convert existing ones
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Readers don't block the writer and the writer doesn't block readers,
+    # syncing on checkpoints only is safe with WAL
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def get_engine():
+    """The engine of the database, created and migrated on the first call"""
+
+    global _engine
+    if _engine is None:
+        import sqlalchemy
+
+        from deviceinfocompare.data import DeclarativeBase
+        from deviceinfocompare.migrations import run_migrations
+
+        setup_logging()
+
+        engine = sqlalchemy.create_engine(
+            "sqlite:///" + os.path.join(BASE_DIR, "deviceinfo.db")
+        )
+        sqlalchemy.event.listen(engine, "connect", set_sqlite_pragmas)
+
+        DeclarativeBase.metadata.create_all(engine)
+        run_migrations(engine)
+        _engine = engine
+
+    return _engine
+
+
+def get_session_factory():
+    """A scoped_session: calling it returns the session of the current thread,
+    remove() closes that session"""
+
+    global _session_factory
+    if _session_factory is None:
+        from sqlalchemy.orm import scoped_session, sessionmaker
+
+        _session_factory = scoped_session(sessionmaker(bind=get_engine()))
+
+    return _session_factory
+
+
+def get_session():
+    """The session of the current thread"""
+
+    return get_session_factory()()
+
+
+def __getattr__(name: str):
+    # ENGINE and SESSION used to be made at import time
+    if name == "ENGINE":
+        return get_engine()
+    elif name == "SESSION":
+        return get_session()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def closeDB() -> None:
-    global ENGINE, SESSION
-    SESSION.close()
-    ENGINE.dispose()
+    """Close the session of this thread and all the pooled connections"""
+
+    if _session_factory is not None:
+        _session_factory.remove()
+    if _engine is not None:
+        _engine.dispose()
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from deviceinfocompare.compare import DeviceDiff
+from deviceinfocompare.data import DeviceRecord
+from deviceinfocompare.monitor import UeventMonitor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceChange:
+    """A device moved from one compare category to another against the baseline
+
+    The categories are those of DeviceDiff, None means the device is neither
+    present now nor part of the baseline
+    """
+
+    device_id: str
+    device: DeviceRecord
+    before: Optional[str]
+    after: Optional[str]
+
+
+CHANGE_MESSAGES = {
+    "missing": "[-] Device is missing now",
+    "new": "[?] New device appeared",
+    "broken": "[-] Device is broken now",
+    "fixed": "[+] Device is fixed now",
+    "unchanged": "[+] Device is back to its dump state",
+    None: "[+] New device went away",
+}
+
+
+def log_device_change(change: DeviceChange) -> None:
+    dev = change.device
+    logger.info(
+        f"{CHANGE_MESSAGES[change.after]}: {dev.device_name} [{dev.device_class}]\n{dev.device_id}"
+    )
+
+
+class DeviceWatcher:
+    """Keeps an indexed current device state and diffs every change against a baseline"""
+
+    MIN_POLL_INTERVAL = 1.0
+    MAX_POLL_INTERVAL = 30.0
+
+    def __init__(
+        self,
+        processor,
+        baseline: Iterable[DeviceRecord],
+        on_change: Callable[[DeviceChange], None] = log_device_change,
+        settle_time: Optional[float] = None,
+        on_settled: Optional[Callable[[List[DeviceRecord]], None]] = None,
+    ) -> None:
+        self.processor = processor
+        self.baseline: Dict[str, DeviceRecord] = {r.device_id: r for r in baseline}
+        self.current: Dict[str, DeviceRecord] = {}
+
+        self.on_change = on_change
+        self.settle_time = settle_time
+        self.on_settled = on_settled
+
+        self.stop_event = threading.Event()
+        self._last_change: Optional[float] = None
+        self._monitor = None
+
+    def _categorize(self, device_id: str) -> Optional[str]:
+        device = self.current.get(device_id)
+        old_device = self.baseline.get(device_id)
+
+        if device is None:
+            return None if old_device is None else "missing"
+        elif old_device is None:
+            return "new"
+        elif device.device_status == old_device.device_status:
+            return "unchanged"
+        elif device.device_status:
+            return "fixed"
+        else:
+            return "broken"
+
+    def update(
+        self, device_id: str, device: Optional[DeviceRecord]
+    ) -> Optional[DeviceChange]:
+        """Apply one device state, None if it has gone, and report what it changed"""
+
+        if self.current.get(device_id) == device:
+            return None
+
+        before = self._categorize(device_id)
+        shown_device = device or self.current.get(device_id)
+
+        if device is None:
+            self.current.pop(device_id, None)
+        else:
+            self.current[device_id] = device
+
+        after = self._categorize(device_id)
+        if before == after:
+            return None
+
+        self._last_change = time.monotonic()
+        change = DeviceChange(device_id, shown_device, before, after)
+        self.on_change(change)
+
+        return change
+
+    def sync(self, devices: Iterable[DeviceRecord]) -> List[DeviceChange]:
+        """Apply a full enumeration"""
+
+        devices = {device.device_id: device for device in devices}
+        changes = []
+
+        for device_id in list(self.current):
+            if device_id not in devices:
+                changes.append(self.update(device_id, None))
+        for device_id, device in devices.items():
+            changes.append(self.update(device_id, device))
+
+        return [change for change in changes if change is not None]
+
+    def diff(self) -> DeviceDiff:
+        diff = DeviceDiff(old_count=len(self.baseline), current_count=len(self.current))
+
+        for device_id in self.current.keys() | self.baseline.keys():
+            category = self._categorize(device_id)
+            getattr(diff, category).append(
+                self.current.get(device_id) or self.baseline[device_id]
+            )
+
+        return diff
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _check_settled(self) -> None:
+        if self.settle_time is None or self.on_settled is None:
+            return
+
+        if (
+            self._last_change is not None
+            and time.monotonic() - self._last_change >= self.settle_time
+        ):
+            self._last_change = None
+            self.on_settled(list(self.current.values()))
+
+    def _watch_uevents(self, monitor: UeventMonitor) -> None:
+        while not self.stop_event.is_set():
+            for uevent in monitor.read_events(timeout=0.5):
+                if uevent["ACTION"] == "overflow":
+                    self.sync(self.processor.enumerate_devices())
+                    continue
+
+                for device_id, device in self.processor.read_event_devices(uevent):
+                    self.update(device_id, device)
+
+            self._check_settled()
+
+    def _watch_polling(self) -> None:
+        interval = self.MIN_POLL_INTERVAL
+
+        # Back off while nothing happens, react quickly again after a change
+        while not self.stop_event.wait(interval):
+            if self.sync(self.processor.enumerate_devices()):
+                interval = self.MIN_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+            self._check_settled()
+
+    def start(self) -> DeviceDiff:
+        """Take the initial state, it is reported as a whole and not as changes"""
+
+        # Listening before enumerating, a change in between is not lost then
+        self._monitor = self.processor.create_change_monitor()
+
+        on_change, self.on_change = self.on_change, lambda change: None
+        try:
+            self.sync(self.processor.enumerate_devices())
+        except BaseException:
+            if self._monitor is not None:
+                self._monitor.close()
+                self._monitor = None
+            raise
+        finally:
+            self.on_change = on_change
+            self._last_change = None
+
+        return self.diff()
+
+    def run(self) -> None:
+        """Watch until stop() is called, start() must have been called before"""
+
+        monitor, self._monitor = self._monitor, None
+        try:
+            if isinstance(monitor, UeventMonitor):
+                logger.debug("Watching kernel uevents")
+                self._watch_uevents(monitor)
+            else:
+                logger.debug("Watching by polling the device list")
+                self._watch_polling()
+        finally:
+            if monitor is not None:
+                monitor.close()